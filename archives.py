@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+    Read log files from gzip files and zip archives without unpacking them to disk
+
+    A log path is one of
+        server.log                                plain file
+        server.log.1.gz                           gzip file
+        PCT-123-45678.zip!logs/server.log.1       member of a zip archive
+
+    Members of zip archives that are themselves compressed are not supported.
+"""
+import os, io, gzip, zipfile, fnmatch
+
+# Separates a zip archive's path from the name of a member in a log path
+ZIP_SEPARATOR = '!'
+
+
+def split_log_path(path):
+    """Return archive, member for a zip archive member log path and path, None otherwise"""
+    if ZIP_SEPARATOR in path:
+        archive, member = path.split(ZIP_SEPARATOR, 1)
+        if is_zip(archive):
+            return archive, member
+    return path, None
+
+
+def is_zip(path):
+    return path.lower().endswith('.zip')
+
+
+def is_gzip(path):
+    return path.lower().endswith('.gz')
+
+
+def is_compressed(path):
+    """Returns True if the log at path is compressed. Compressed logs can't be seeked"""
+    archive, member = split_log_path(path)
+    return member is not None or is_gzip(path)
+
+
+def get_archive_path(path):
+    """Returns the path of the file on disk that holds log path"""
+    return split_log_path(path)[0]
+
+
+def open_log(path):
+    """Returns a binary file object for log path"""
+    archive, member = split_log_path(path)
+    if member is not None:
+        zf = zipfile.ZipFile(archive)
+        try:
+            # The member file has its own handle on the archive
+            return zf.open(member)
+        finally:
+            zf.close()
+    if is_gzip(path):
+        # BufferedReader makes readline() much faster than GzipFile's own
+        return io.BufferedReader(gzip.open(path, 'rb'))
+    return open(path, 'rb')
+
+
+def seek_log(f, pos):
+    """Move log file object f, as returned by open_log(), to byte pos of the uncompressed log
+        Zip archive members can't seek so the bytes before pos are read and discarded
+    """
+    # Python 2 files have no seekable()
+    if not hasattr(f, 'seekable') or f.seekable():
+        f.seek(pos)
+        return
+    while pos > 0:
+        block = f.read(min(pos, 1024 * 1024))
+        if not block:
+            break
+        pos -= len(block)
+
+
+def get_log_size(path):
+    """Returns the uncompressed size of log path without reading it or None for gzip files
+        The size at the end of a gzip file is only the size modulo 4 GB of its last member so
+        the sizes of gzip files are only known by reading them. See get_file_stamp()
+    """
+    archive, member = split_log_path(path)
+    if member is not None:
+        zf = zipfile.ZipFile(archive)
+        try:
+            return zf.getinfo(member).file_size
+        finally:
+            zf.close()
+    if is_gzip(path):
+        return None
+    return os.path.getsize(path)
+
+
+def get_file_stamp(path):
+    """Returns the size and modification time of the file on disk that holds log path. Used to
+        tell whether a compressed log has changed since it was read
+    """
+    st = os.stat(get_archive_path(path))
+    return st.st_size, int(st.st_mtime)
+
+
+def read_log_head(path, n):
+    """Returns the first n bytes of the uncompressed contents of log path"""
+    f = open_log(path)
+    try:
+        return f.read(n)
+    finally:
+        f.close()
+
+
+def read_log(path):
+    """Returns the whole uncompressed contents of log path as a string"""
+    f = open_log(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def expand_archives(paths, member_pattern='*'):
+    """Returns paths with each zip archive replaced by the log paths of its members whose
+        names match member_pattern
+    """
+    log_paths = []
+    for path in paths:
+        if not is_zip(path):
+            log_paths.append(path)
+            continue
+        try:
+            zf = zipfile.ZipFile(path)
+        except zipfile.BadZipfile as e:
+            print 'Could not read %s: %s' % (path, e)
+            continue
+        try:
+            members = sorted(zf.namelist())
+        finally:
+            zf.close()
+        log_paths.extend(ZIP_SEPARATOR.join((path, member)) for member in members
+                         if not member.endswith('/')
+                             and fnmatch.fnmatch(os.path.basename(member), member_pattern))
+    return log_paths
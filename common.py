@@ -5,13 +5,15 @@
     Requires pandas 0.11.0 or higher
 """
 from __future__ import division
-import re, sys, glob, os, time 
+import re, sys, glob, os, time, shutil
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series, Timestamp, DateOffset, HDFStore
+import tables
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 import cPickle as pickle
+from collections import OrderedDict
 
 
 def versions():
@@ -56,14 +58,448 @@ def save_df(path, df):
 def load_df(path, default=None):
     """Load DataFrame for HDF5 store path '\logs' table"""
     try:
-        store = HDFStore(path)
-        print store.keys()
+        # The default mode 'a' changes the file's modification time
+        store = HDFStore(path, mode='r')
         df = store.get('logs')
         store.close()
         return df
     except:
         return default
         
+
+#
+# Time-partitioned columnar DataFrame stores
+#
+# A partitioned store is a directory <name>.parts with one PyTables file per day, named 
+#  YYYY-MM-DD.h5, of the rows with timestamps in that day. Each column is a separate compressed
+#  extendable array so reading a column reads only that column
+#   /timestamp                  int64 nanoseconds of the DatetimeIndex
+#   /columns/<column>           column values. The codes of categorical columns
+#   /categories/<column>        categories of categorical columns
+#  The root node's attributes hold the column order and whether the rows are in time order
+#  The DataFrame must have a DatetimeIndex
+#
+PARTITION_EXT = '.parts'
+PARTITION_FILTERS = tables.Filters(complevel=9, complib='blosc')
+# Rows per chunk of the arrays. This is the smallest amount of an array that is read
+PARTITION_CHUNK_ROWS = 16 * 1024
+
+
+def get_partition_paths(path, start=None, end=None):
+    """Returns paths of the day partitions in partitioned store path that may have rows with
+        timestamps in [start, end]. None means no bound
+    """
+    paths = sorted(glob.glob(os.path.join(path, '*.h5')))
+    if start is not None:
+        first = Timestamp(start).strftime('%Y-%m-%d')
+        paths = [p for p in paths if get_name_from_path(p) >= first]
+    if end is not None:
+        last = Timestamp(end).strftime('%Y-%m-%d')
+        paths = [p for p in paths if get_name_from_path(p) <= last]
+    return paths
+
+
+def _to_array(values):
+    """Returns values as a numpy array that PyTables can store. Strings are stored fixed width"""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = values.astype(str)
+        if values.itemsize == 0:
+            values = values.astype('S1')
+    return values
+
+
+def _append_array(h5, where, name, values):
+    """Append numpy array values to array where/name in open PyTables file h5, creating it if 
+        necessary. A string array is rewritten wider if values has longer strings than it holds
+    """
+    if name not in h5.get_node(where):
+        h5.create_earray(where, name, obj=values, filters=PARTITION_FILTERS, 
+                         chunkshape=(PARTITION_CHUNK_ROWS,))
+        return
+    arr = h5.get_node(where, name)
+    if values.dtype.kind == 'S' and values.itemsize > arr.atom.itemsize:
+        old = arr.read()
+        arr.remove()
+        _append_array(h5, where, name, np.concatenate([old.astype(values.dtype), values]))
+        return
+    arr.append(values.astype(arr.atom.dtype) if values.dtype.kind == 'S' else values)
+
+
+def _append_partition(part_path, df):
+    """Append DataFrame df, all of whose rows are in one day, to the partition at part_path"""
+    exists = os.path.exists(part_path)
+    h5 = tables.open_file(part_path, mode='a')
+    try:
+        attrs = h5.root._v_attrs
+        ts = df.index.values.view(np.int64)
+        if not exists:
+            h5.create_group('/', 'columns')
+            h5.create_group('/', 'categories')
+            attrs.columns = list(df.columns)
+            attrs.in_order = True
+        else:    
+            assert list(df.columns) == list(attrs.columns), (list(df.columns), attrs.columns)
+            if len(h5.root.timestamp) and h5.root.timestamp[-1] > ts[0]:
+                attrs.in_order = False
+        attrs.in_order = attrs.in_order and bool((np.diff(ts) >= 0).all())
+        _append_array(h5, '/', 'timestamp', ts)
+        for name in df.columns:
+            column = df[name]
+            if hasattr(column, 'cat'):
+                # Categories are only ever appended to so existing codes remain valid
+                categories = column.cat.categories
+                if name in h5.root.categories:
+                    old = list(h5.root.categories._f_get_child(name).read())
+                    old_set = set(old)
+                    new = [c for c in categories if c not in old_set]
+                    if new:
+                        _append_array(h5, '/categories', name, _to_array(new))
+                    categories = old + new
+                else:
+                    _append_array(h5, '/categories', name, _to_array(list(categories)))
+                    categories = list(categories)
+                codes = column.cat.set_categories(categories).cat.codes.values
+                _append_array(h5, '/columns', name, codes.astype(np.int32))
+            else:
+                _append_array(h5, '/columns', name, _to_array(column.values))
+    finally:
+        h5.close()
+
+
+def append_partitioned_df(path, df):
+    """Append the rows of DataFrame df to partitioned store path
+        df must have a DatetimeIndex
+    """
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError('Partitioned stores need a DatetimeIndex. index=%s' % type(df.index))
+    if not os.path.exists(path):
+        os.makedirs(path)
+    days = df.index.normalize()
+    for day in days.unique():
+        _append_partition(os.path.join(path, day.strftime('%Y-%m-%d') + '.h5'), 
+                          df[days == day])
+
+
+def save_partitioned_df(path, df):
+    """Save DataFrame df in partitioned store path, replacing any existing store"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    append_partitioned_df(path, df)
+
+
+def _load_partition(part_path, columns, start, end, levels):
+    """Returns timestamps, data for the rows of the partition at part_path with timestamps in 
+        [start, end] and level in levels
+        timestamps: int64 nanoseconds
+        data: [(column, values)] for columns, with values (codes, categories) for categorical
+              columns
+        Only these rows and columns are read
+    """
+    h5 = tables.open_file(part_path, mode='r')
+    try:
+        if columns is None:
+            columns = list(h5.root._v_attrs.columns)
+        ts = h5.root.timestamp.read()
+        lo, hi = 0, len(ts)
+        mask = None
+        if h5.root._v_attrs.in_order:
+            # Time bounds become a slice so only the chunks in the time range are read
+            if start is not None:
+                lo = ts.searchsorted(Timestamp(start).value, side='left')
+            if end is not None:
+                hi = ts.searchsorted(Timestamp(end).value, side='right')
+            ts = ts[lo:hi]
+        else:
+            mask = np.ones(len(ts), dtype=bool)
+            if start is not None:
+                mask &= ts >= Timestamp(start).value
+            if end is not None:
+                mask &= ts <= Timestamp(end).value
+
+        def get_categories(name):
+            if name in h5.root.categories:
+                return h5.root.categories._f_get_child(name).read().astype(object)
+            return None
+
+        if levels is not None:
+            codes = h5.root.columns.level[lo:hi]
+            wanted = np.flatnonzero(np.in1d(get_categories('level'), list(levels)))
+            level_mask = np.in1d(codes, wanted)
+            mask = level_mask if mask is None else mask & level_mask
+
+        if mask is not None:
+            ts = ts[mask]
+        data = []
+        for name in columns:
+            values = h5.root.columns._f_get_child(name)[lo:hi]
+            if mask is not None:
+                values = values[mask]
+            categories = get_categories(name)
+            if categories is not None:
+                values = values, categories
+            elif values.dtype.kind == 'S':
+                values = values.astype(object)
+            data.append((name, values))
+        return ts, data
+    finally:
+        h5.close()
+
+
+def _concat_categorical(codes_categories):
+    """Returns a Categorical of the concatenation of the (codes, categories) in 
+        codes_categories. Works on the codes as pd.concat() and union_categoricals() are very 
+        slow for categoricals with many categories
+    """
+    categories = pd.Index(sorted(set().union(*(c for _, c in codes_categories))))
+    # The -1 appended to each mapping keeps the -1 codes of missing values as -1
+    codes = [np.append(categories.get_indexer(c), -1)[k] for k, c in codes_categories]
+    return pd.Categorical.from_codes(np.concatenate(codes), categories)
+
+
+def load_partitioned_df(path, columns=None, start=None, end=None, levels=None, default=None):
+    """Load DataFrame from partitioned store path
+        columns: Columns to read. None means all columns
+        start, end: Only read rows with timestamps in [start, end]. None means no bound
+        levels: Only read rows whose 'level' column is in levels. None means all levels
+        Only the day partitions that overlap [start, end] are opened
+    """
+    if not os.path.isdir(path):
+        return default
+    parts = [_load_partition(part_path, columns, start, end, levels)
+             for part_path in get_partition_paths(path, start, end)]
+    if not parts:
+        return default
+    columns = [name for name, _ in parts[0][1]]
+    data = {}
+    for i, name in enumerate(columns):
+        values = [d[i][1] for _, d in parts]
+        # Day partitions have their own categories
+        if isinstance(values[0], tuple):
+            data[name] = _concat_categorical(values)
+        else:
+            data[name] = np.concatenate(values)
+    index = pd.DatetimeIndex(np.concatenate([ts for ts, _ in parts]), name='timestamp')
+    return DataFrame(data, index=index, columns=columns)
+
+
+# Memory budget of the cache of objects loaded by ObjectDirectory.load()
+OBJECT_CACHE_MB = 500
+
+# Returned by loaders when there is no object to load
+_MISSING = object()
+
+
+def get_object_size(path, obj):
+    """Returns an estimate of the memory used by object obj loaded from path"""
+    if isinstance(obj, (DataFrame, Series)):
+        return int(np.sum(obj.memory_usage(deep=True)))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    # Pickles are about as big on disk as in memory
+    return os.path.getsize(path)
+
+
+def get_file_signature(path):
+    """Returns a value that changes when the file at path changes"""
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+class ObjectCache:
+    """ Cache of objects loaded from files
+        
+        The least recently used objects are evicted when the estimated size of the cached 
+        objects exceeds max_bytes. An object is reloaded when the modification time or size 
+        of its file changes
+        Cached objects are returned to every caller that loads them so they must not be 
+        modified in place
+    """
+    def __init__(self, max_bytes=OBJECT_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # {path: (obj, file signature, estimated size)} in least recently used order
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, loader):
+        """Returns the object loaded from path by loader(path, _MISSING) or _MISSING if there 
+            is none
+        """
+        try:
+            signature = get_file_signature(path)
+        except OSError:
+            self.invalidate(path)
+            self.misses += 1
+            return _MISSING
+        if path in self._cache:
+            obj, saved_signature, size = self._cache.pop(path)
+            if saved_signature == signature:
+                # Move to the most recently used end
+                self._cache[path] = obj, saved_signature, size
+                self.hits += 1
+                return obj
+            self._bytes -= size
+        self.misses += 1
+        obj = loader(path, _MISSING)
+        if obj is not _MISSING:
+            size = get_object_size(path, obj)
+            self._cache[path] = obj, signature, size
+            self._bytes += size
+            self._evict()
+        return obj
+
+    def invalidate(self, path):
+        """Remove the object for path from the cache"""
+        if path in self._cache:
+            _, _, size = self._cache.pop(path)
+            self._bytes -= size
+
+    def _evict(self):
+        """ Evict least recently used objects until the cache is within budget. The most 
+            recently used object is always kept
+        """
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, _, size) = self._cache.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def show_stats(self):
+        print 'Object cache: hits=%d, misses=%d, evictions=%d, objects=%d, bytes=%d' % (
+            self.hits, self.misses, self.evictions, len(self._cache), self._bytes)
+
+
+def _as_list(values):
+    """Returns values as a list. A single string is a list of one value"""
+    return [values] if isinstance(values, basestring) else list(values)
+
+
+class LogQuery:
+    """ Lazy query of a table of log entries in an HDF5 store, such as the '/logs' table in 
+        the logs.h5 files made by load_logs.py
+        
+        Nothing is read until df(), chunks() or count() is called. The filters are made into 
+        an HDFStore.select() where clause so only the rows that match them are read. The 
+        filtered columns must be data columns of the table. See load_logs.LogSaver.DATA_COLUMNS
+        
+        Filters
+            start, end : Time range of the entries. None means no bound
+            levels, files, threads : Values of the level, file and thread columns
+            file_lines : (file, line) pairs. The rows with any of the files and any of the 
+                         lines are read and then the rows for other pairs are dropped
+            columns : Columns to return. None means all columns
+        
+        e.g. 
+            query = directory.query('logs.h5', levels=['ERROR'], start='2013-05-01')
+            for df in query.filter(file_lines=[('JobManager', 12)]).chunks(100000):
+                ...
+    """
+    FILTERS = ['start', 'end', 'levels', 'files', 'threads', 'file_lines', 'columns']
+    
+    def __init__(self, path, key='logs', **filters):
+        unknown = set(filters) - set(LogQuery.FILTERS)
+        if unknown:
+            raise TypeError('Unknown LogQuery filters %s' % sorted(unknown))
+        self.path = path
+        self.key = key
+        self.filters = filters
+
+    def __repr__(self):
+        return 'LogQuery(%r, %r, %r)' % (self.path, self.key, self.filters)
+
+    def filter(self, **filters):
+        """Returns a new LogQuery with filters added to, or replacing, the filters of this one"""
+        merged = dict(self.filters)
+        merged.update(filters)
+        return LogQuery(self.path, self.key, **merged)
+
+    def get_where(self):
+        """Returns the HDFStore.select() where clause for the filters or None if there are 
+            no row filters
+        """
+        filters = self.filters
+        terms = []
+        if filters.get('start') is not None:
+            terms.append('index >= %r' % str(Timestamp(filters['start'])))
+        if filters.get('end') is not None:
+            terms.append('index <= %r' % str(Timestamp(filters['end'])))
+        for column, name in ('level', 'levels'), ('file', 'files'), ('thread', 'threads'):
+            if filters.get(name) is not None:
+                terms.append('%s = %r' % (column, [str(v) for v in _as_list(filters[name])]))
+        if filters.get('file_lines') is not None:
+            # An or of (file, line) conditions overflows the numexpr parser for more than a 
+            #  few pairs
+            file_lines = filters['file_lines']
+            terms.append('file = %r' % sorted(set(str(fl) for fl, _ in file_lines)))
+            terms.append('line = %r' % sorted(set(int(ln) for _, ln in file_lines)))
+        return terms or None
+
+    def _get_columns(self):
+        """Returns the columns to read. file and line are needed to match file_lines"""
+        columns = self.filters.get('columns')
+        if columns is None or self.filters.get('file_lines') is None:
+            return columns
+        return list(columns) + [c for c in ('file', 'line') if c not in columns]
+
+    def _refine(self, df):
+        """Returns the rows of DataFrame df, read with get_where(), that match the filters"""
+        file_lines = self.filters.get('file_lines')
+        if file_lines is None:
+            return df
+        pairs = set((str(fl), int(ln)) for fl, ln in file_lines)
+        keep = np.array([(fl, ln) in pairs for fl, ln in zip(df['file'], df['line'])], 
+                        dtype=bool)
+        df = df[keep] if len(df) else df
+        columns = self.filters.get('columns')
+        return df if columns is None else df[list(columns)]
+
+    def _select(self, store, **kwargs):
+        return store.select(self.key, where=self.get_where(), columns=self._get_columns(),
+                            **kwargs)
+
+    def df(self):
+        """Returns a DataFrame of the matching rows"""
+        store = HDFStore(self.path, mode='r')
+        try:
+            return self._refine(self._select(store))
+        finally:
+            store.close()
+
+    def chunks(self, chunksize=100000):
+        """Generator of DataFrames of up to chunksize matching rows, in table order"""
+        store = HDFStore(self.path, mode='r')
+        try:
+            # The coordinates of the matching rows are found once, using the table's indexes.
+            #  HDFStore.select(iterator=True) is much slower for selective where clauses
+            where = self.get_where()
+            if where is None:
+                n = store.get_storer(self.key).nrows
+                for start in xrange(0, n, chunksize):
+                    yield self._refine(self._select(store, start=start, stop=start + chunksize))
+            else:
+                coordinates = store.select_as_coordinates(self.key, where=where)
+                for start in xrange(0, len(coordinates), chunksize):
+                    yield self._refine(store.select(self.key, 
+                                                    where=coordinates[start:start + chunksize],
+                                                    columns=self._get_columns()))
+        finally:
+            store.close()
+
+    def count(self):
+        """Returns the number of matching rows"""
+        if self.filters.get('file_lines') is not None:
+            return len(self.filter(columns=['file', 'line']).df())
+        store = HDFStore(self.path, mode='r')
+        try:
+            where = self.get_where()
+            if where is None:
+                return store.get_storer(self.key).nrows
+            return len(store.select_as_coordinates(self.key, where=where))
+        finally:
+            store.close()
+
       
 def get_name_from_path(path):
     base = os.path.basename(path)
@@ -77,11 +513,18 @@ class ObjectDirectory:
         DataFrames are stored in HDF5 files with extension .h5 in 
         table '\log' (FIXME)
         
+        DataFrames of log entries can also be stored in time-partitioned columnar stores, 
+        which are directories with extension .parts
+        
         All other object types are pickled with extension .pkl
         
+        Objects loaded with load() are kept in ObjectDirectory.cache, which is shared by all 
+        ObjectDirectorys. Don't modify them in place
+        
     """    
 
     ROOT = 'data'
+    cache = ObjectCache()
     
     def __init__(self, name):
         self.name = name
@@ -94,7 +537,7 @@ class ObjectDirectory:
     def get_toc(self, temp=False):
         def get_matches(pattern):
             return glob.glob(os.path.join(self.get_dir(temp), pattern))
-        matches = get_matches('*.h5') + get_matches('*.pkl')
+        matches = get_matches('*.h5') + get_matches('*.pkl') + get_matches('*' + PARTITION_EXT)
         return {get_name_from_path(path): path for path in matches}
     
     def make_dir_if_necessary(self, path):
@@ -111,12 +554,14 @@ class ObjectDirectory:
             dir = os.path.join(dir, 'temp')
         return dir
  
-    def get_path(self, obj_name, temp=False, is_df=False):
+    def get_path(self, obj_name, temp=False, is_df=False, partitioned=False):
         """Only call this with an extension on obj_name if obj_name is 
-            a file
+            a file or a partitioned store
         """
-        if obj_name.endswith('.h5') or obj_name.endswith('.pkl'):
+        if any(obj_name.endswith(e) for e in ('.h5', '.pkl', PARTITION_EXT)):
             ext = ''
+        elif partitioned:
+            ext = PARTITION_EXT
         else:    
             ext = '.h5' if is_df else '.pkl'
         return os.path.join(self.get_dir(temp), obj_name) + ext
@@ -124,31 +569,50 @@ class ObjectDirectory:
     @staticmethod
     def save_object(path, obj):
         is_df = isinstance(obj, DataFrame)
-        if is_df:
+        if path.endswith(PARTITION_EXT):
+            save_partitioned_df(path, obj)
+        elif is_df:
             save_df(path, obj)
         else:    
             save_object(path, obj)
            
     @staticmethod
-    def load_object(path, default=None):
+    def load_object(path, default=None, **kwargs):
+        """kwargs are passed to load_partitioned_df() for partitioned stores"""
         is_df = path.endswith('.h5')
-        print 'is_df', is_df, path
-        if is_df:
+        if path.endswith(PARTITION_EXT):
+            return load_partitioned_df(path, default=default, **kwargs)
+        elif is_df:
             return load_df(path, default)
         else:    
             return load_object(path, default)       
 
-    def save(self, obj_name, obj, temp=False):
+    def save(self, obj_name, obj, temp=False, partitioned=False):
+        """partitioned: Save DataFrame obj in a time-partitioned columnar store"""
         is_df = isinstance(obj, DataFrame)
-        path = self.get_path(obj_name, temp, is_df)
+        path = self.get_path(obj_name, temp, is_df, partitioned)
         self.make_dir_if_necessary(path)
         ObjectDirectory.save_object(path, obj)
+        ObjectDirectory.cache.invalidate(path)
         self.toc[obj_name] = obj
 
-    def load(self, obj_name, temp=False, default=None):
+    def query(self, obj_name='logs.h5', temp=False, **filters):
+        """Returns a LogQuery of the log entries in HDF5 store obj_name"""
+        return LogQuery(self.get_path(obj_name, temp, is_df=True), **filters)
+
+    def load(self, obj_name, temp=False, default=None, **kwargs):
+        """Objects are loaded from ObjectDirectory.cache if they are there and their files 
+            haven't changed
+            kwargs select the columns and rows read from a partitioned store obj_name.parts
+            e.g. directory.load('logs.parts', columns=['file', 'line'], levels=['ERROR'],
+                                start='2013-05-01', end='2013-05-01 23:59:59.999999')
+            Partitioned stores aren't cached as they are read a part at a time
+        """
         is_df = obj_name.endswith('.h5')
         path = self.get_path(obj_name, temp, is_df)
-        print is_df, path
-        return ObjectDirectory.load_object(path, default)
+        if path.endswith(PARTITION_EXT):
+            return ObjectDirectory.load_object(path, default, **kwargs)
+        obj = ObjectDirectory.cache.get(path, ObjectDirectory.load_object)
+        return default if obj is _MISSING else obj
 
  
\ No newline at end of file
@@ -7,38 +7,87 @@
     e.g. 
         python load_logs.py -s -o out_dir -i in_dir\server.log*
     
+        python load_logs.py -j 8 -o out_dir -i in_dir\server.log*
+        
+        - as above but the server.log files are loaded in a pool of 8 processes, one file per 
+          process. A single server.log file to load is split into byte ranges that are 
+          decoded in 8 processes. Compressed server.log files can't be split
+    
+        python load_logs.py -p -o out_dir -i in_dir\server.log*
+        
+        - as above but the log entries are also saved in data/out_dir/logs.parts, which is 
+          partitioned by day. e.g. to read one day's ERROR entries
+            ObjectDirectory('out_dir').load('logs.parts', levels=['ERROR'], 
+                start='2013-05-01', end='2013-05-01 23:59:59.999999')
+    
         - parses all the server_log* files in in_dir
         - converts them to a DataFrame
+          server.log*.gz files and the server.log* members of zip archives matched by the
+          pattern are read without unpacking them
         - saves the DataFrame in the HDF5 file data/out_dir/logs.h5 in table '/logs'
         
         This is done in 2 steps
         
         1. Each server log is converted to an DataFrame and saved as a table in 
             data/out_dir/temp/progress.h5
-        2. The HDF5 files in data/out_dir/temp are combined and saved as data/out_dir/logs.h5
+        2. The DataFrames in data/out_dir/temp/progress.h5 are appended one at a time, in 
+            time order, to the indexed table '/logs' in data/out_dir/logs.h5
         
         This is done to allow restarting during the processing of very large collections of 
         server.log files.
+        
+        Running again with the same out_dir only loads the bytes that have been appended to 
+        the server.log files since the last run. server.log files that have been rotated, 
+        copied or compressed since they were loaded are recognised and not loaded again.
+        
+        Each server.log file is summarised before it is loaded: first and last timestamps, 
+        number of log entries of each level, size and number of lines. The summaries are used 
+        to check that the files don't overlap in time, to order them and to plan the loading.
+        They are saved with the final table. load_summaries('out_dir') returns them.
 
     FIXME:    
         Replace table '/logs' with '/table'        
     
 """
 from __future__ import division
-import re, sys, glob, os, time 
+import re, sys, glob, os, time, shutil, hashlib
+import multiprocessing as mp
+import cPickle as pickle
+from array import array
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series, Timestamp, DateOffset, HDFStore
-from common import ObjectDirectory, versions
+from pandas.api.types import union_categoricals
+from common import ObjectDirectory, versions, append_partitioned_df
+from minute_counts import MinuteCounter
+from archives import open_log, is_compressed, expand_archives, seek_log, get_log_size, \
+    read_log_head, get_file_stamp
 
 
 def parse_timestamp(timestamp):
-    """Convert a string of the form 2011-03-10 15:10:34,687
+    """Convert a string of the form 2011-03-10 15:10:34,687 or 2011-03-10 15:10:34
       to a pandas TimeStamp
     """
-    # Do we need to make this more tolerant of missing values?
-    dt, ms = timestamp.split(',')
-    return Timestamp(dt) + DateOffset(microseconds=int(ms)*1000)
+    dt, _, ms = timestamp.partition(',')
+    return Timestamp(dt) + DateOffset(microseconds=int(ms or '0')*1000)
+
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def parse_timestamps(timestamps):
+    """Convert a sequence of strings of the form 2011-03-10 15:10:34,687 or
+        2011-03-10 15:10:34 to a numpy datetime64[ns] array in one vectorized step.
+        The digits after the , are milliseconds, as in parse_timestamp()
+    """
+    parts = Series(timestamps, dtype=object).str.partition(',')
+    dt, ms = parts[0], parts[2]
+    try:
+        dt = pd.to_datetime(dt, format=TIMESTAMP_FORMAT)
+    except ValueError:
+        # PATTERN_LOG_LINE allows any whitespace between date and time
+        dt = pd.to_datetime(dt.str.replace(r'\s+', ' '), format=TIMESTAMP_FORMAT)
+    ms = pd.to_numeric(ms.where(ms.str.len() > 0, '0')).values
+    return dt.values + ms.astype('timedelta64[ms]')
     
    
 # Log lines look like
@@ -65,51 +114,94 @@ PATTERN_LOG_LINE = r'''
 ENTRY_KEYS = re.findall(r'\?P<(\w+)>', PATTERN_LOG_LINE)
 RE_LOG_LINE = re.compile(PATTERN_LOG_LINE, re.IGNORECASE|re.DOTALL|re.VERBOSE)
 
+# content is stored as a template and its parameters. See split_content()
+_i = ENTRY_KEYS.index('content')
+ENTRY_KEYS[_i:_i + 1] = ['template', 'params']
+
 ENTRY_KEYS_SIMPLE = ENTRY_KEYS[:4]
 
-def ___decode_log_line_simple(line):
-    """ Return a parial list of the parts of a server.log line
-        - date
-        - time
-        - level
-        - file
-        - line
+# Columns of repeated strings. These are interned while decoding and stored as categoricals
+CATEGORY_KEYS = ['level', 'file', 'thread', 'template']
+
+# Log entry contents are mostly the same messages with different numbers. e.g.
+#   Error during XMLRPC request on: client-xmlrpc, IP: 10.203.0.122
+#  The numbers, including IP addresses and times, are the parameters of a content's template
+#  Literal PARAM_MARKs in contents are treated as parameters so that templates and 
+#  parameters always give back the content
+PARAM_MARK = '<*>'
+PARAM_SEP = '|'
+RE_PARAM = re.compile(r'(\d+(?:[.:,/-]\d+)*|%s)' % re.escape(PARAM_MARK))
+
+
+def split_content(content):
+    """Returns template, params for log entry content
+        template: content with each parameter replaced by PARAM_MARK
+        params: The parameters joined by PARAM_SEP
+        e.g. 'job 12 on 10.0.0.1' -> 'job <*> on <*>', '12|10.0.0.1'
     """
-    parts = line[:100].split()[:4]
-    if len(parts) < 4 or all(parts[2] != x for x in ('ERROR', 'INFO', 'DEBUG')):
-        return None
-    try:    
-        fl, ln_s = parts[3].split(':')
-        ln = int(ln_s)
-        return [parse_timestamp(' '.join(parts[:2])),
-                parts[2],
-                fl,
-                ln]  
-    except Exception as e:
-        print
-        print '!' * 80
-        print e
-        print line[:100]
-        print parts
-        print parts[3]
-        print '^' * 80
-        return None
+    parts = RE_PARAM.split(content)
+    return PARAM_MARK.join(parts[0::2]), PARAM_SEP.join(parts[1::2])
+
+
+def join_content(template, params):
+    """Returns the content that split_content() split into template, params"""
+    parts = template.split(PARAM_MARK)
+    if len(parts) == 1:
+        return template
+    values = params.split(PARAM_SEP)
+    return ''.join(sum(zip(parts, values), ())) + parts[-1]
+
+
+def get_content(df):
+    """Returns a Series of the contents of the log entries in DataFrame df, which has template 
+        and params columns
+    """
+    return Series([join_content(t, p) for t, p in zip(df['template'], df['params'])], 
+                  index=df.index, name='content')
+
+
+def may_be_log_entry(line):
+    """Cheap test of whether line can be a server.log entry. Used to reject stack trace and
+        other continuation lines without running RE_LOG_LINE
+        
+        Checks for a YYYY-MM-DD HH:MM:SS timestamp at the start of line followed by optional 
+        ,ddd milliseconds, whitespace and the first letter of the level token. As in 
+        PATTERN_LOG_LINE, the date and time may be separated by any whitespace. Lines that pass 
+        this test may still fail to match RE_LOG_LINE
+    """
+    if (len(line) < 21 or line[4] != '-' or line[7] != '-' or not line[10].isspace() 
+        or not line[:4].isdigit()):
+        return False
+    # Start of the time. The date and time are nearly always separated by one space
+    t = 11
+    if line[t].isspace():
+        t = len(line) - len(line[t:].lstrip())
+    if len(line) < t + 10 or line[t + 2] != ':' or line[t + 5] != ':':
+        return False
+    level = line[t + 8:t + 21].lstrip(',0123456789')
+    return level[:1].isspace() and level.lstrip()[:1].isalpha()
 
     
 def decode_log_line(line):
     """ Return a list of the parts of a server.log line
         See PATTERN_LOG_LINE for the parts
+        The timestamp is returned as a string. log_file_to_df() converts the timestamps
+        of all lines in a file with parse_timestamps()
     """
-    m = RE_LOG_LINE.search(line)
+    if not may_be_log_entry(line):
+        return None
+    m = RE_LOG_LINE.match(line)
     if not m:
         return None
     d = m.groupdict() 
+    template, params = split_content(d.get('content', '[EMPTY]')[:256])
     return [
-        parse_timestamp(d.get('timestamp', '')),
+        d.get('timestamp', ''),
         d.get('level'),
         d.get('file'),
         int(d.get('line', '-1')),
-        d.get('content', '[EMPTY]')[:256],
+        template,
+        params,
         d.get('thread')
     ] 
     
@@ -117,69 +209,213 @@ def decode_log_line(line):
 def decode_log_line_simple(line):
     """ Return a list of the parts of a server.log line
         See PATTERN_LOG_LINE for the parts
+        The timestamp is returned as a string. log_file_to_df() converts the timestamps
+        of all lines in a file with parse_timestamps()
     """
-    m = RE_LOG_LINE.search(line)
+    if not may_be_log_entry(line):
+        return None
+    m = RE_LOG_LINE.match(line)
     if not m:
         return None
     d = m.groupdict() 
     return [
-        parse_timestamp(d.get('timestamp', '')),
+        d.get('timestamp', ''),
         d.get('level'),
         d.get('file'),
         int(d.get('line', '-1')),
     ]     
 
 
-def get_header_entries(log_file, extra):
-    """ Returns decoded log entries for all well-formed log entries in a log file"""
+def get_header_entries(log_file, extra, start=0, end=None):
+    """ Returns header, columns for all well-formed log entries in a log file
+        columns has one buffer per entry key (ENTRY_KEYS or ENTRY_KEYS_SIMPLE) 
+        If start and end are given then only the lines that start in byte range 
+        [start, end) are decoded. start must be the start of a line. Header lines are
+        only looked for when start is 0
+        end=None means the end of the file
+    """
     
     decoder = decode_log_line if extra else decode_log_line_simple
+    entry_keys = ENTRY_KEYS if extra else ENTRY_KEYS_SIMPLE
+    
+    # Line numbers are kept in a compact array. The other columns are lists of strings
+    columns = [array('i') if key == 'line' else [] for key in entry_keys]
+    column_appends = [col.append for col in columns]
+    # Repeated strings are interned so that each value is stored once
+    interned = [key in CATEGORY_KEYS for key in entry_keys]
     
-    entries = []
     header = []
-    in_header = True
-    with open(log_file, 'rt') as f:
+    in_header = start == 0
+    pos = start
+    with open_log(log_file) as f:
+        if start:
+            seek_log(f, start)
         for i, line in enumerate(f):
-            line = line.rstrip('\n')
+            if end is not None and pos >= end:
+                break
+            pos += len(line)
+            line = line.rstrip('\r\n')
             entry = decoder(line)
             if entry:
-                entries.append(entry)
+                for append, intern_it, x in zip(column_appends, interned, entry):
+                    append(intern(x) if intern_it else x)
             elif in_header:
                 if i < 10 and line.startswith('#'):
                     header.append(line)
                 else:
                     in_header = False
-    return header, entries                
+    return header, columns                
+
+    
+def get_byte_ranges(log_file, n_ranges, start=0, end=None):
+    """Returns a list of (start, end) byte ranges that split byte range [start, end) of 
+        log_file into at most n_ranges parts of roughly equal size. Each range starts at the 
+        start of a line. start must be the start of a line. end=None means the end of the file
+    """
+    size = os.path.getsize(log_file) if end is None else end
+    starts = [start]
+    with open(log_file, 'rb') as f:
+        for i in range(1, n_ranges):
+            f.seek(max(start + (size - start) * i // n_ranges, starts[-1]))
+            # Skip to the start of the next line
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > starts[-1]:
+                starts.append(pos)
+    return zip(starts, starts[1:] + [size])
+
+
+def _byte_range_to_df(params):
+    """Returns header, DataFrame for a byte range of a log file
+        Process pool worker for log_file_to_df_parallel()
+    """
+    log_file, extra, start, end = params
+    header, columns = get_header_entries(log_file, extra, start, end)
+    return header, columns_to_df(columns, extra)
+
 
+# Don't split log files into byte ranges smaller than this
+MIN_RANGE_SIZE = 4 * 1024 * 1024
+
+def log_file_to_df_parallel(log_file, extra, jobs, start=0, end=None):
+    """Returns a pandas DataFrame whose rows are the decoded entries of the lines in byte 
+        range [start, end) of log_file
+        The byte range is split into smaller byte ranges that are decoded in a pool of jobs 
+        processes
+        The result is the same as log_file_to_df(log_file, extra, start=start, end=end)
+    """
+    size = os.path.getsize(log_file) if end is None else end
+    n_ranges = min(jobs, (size - start) // MIN_RANGE_SIZE + 1)
+    params = [(log_file, extra, range_start, range_end) 
+              for range_start, range_end in get_byte_ranges(log_file, n_ranges, start, end)]
+    if len(params) <= 1:
+        return log_file_to_df(log_file, extra, start=start, end=end)
     
-def log_file_to_df(log_file, extra):
-    """Returns a pandas DataFrame whose rows are the decoded entries of the lines in log_file"""
-    # Why can't we construct a DataFrame with a generator?
-    header, entries = get_header_entries(log_file, extra)
-    if not entries:
+    pool = mp.Pool(len(params))
+    try:
+        results = pool.map(_byte_range_to_df, params)
+    finally:
+        pool.close()
+        pool.join()
+
+    # Only the first range has a header
+    header = results[0][0]
+    df_list = [df for _, df in results if df is not None]
+    if not df_list:
+        return None, None
+    return header, concat_logs(df_list, ignore_index=True)
+
+
+def log_file_to_df(log_file, extra, jobs=1, start=0, end=None):
+    """Returns a pandas DataFrame whose rows are the decoded entries of the lines in byte 
+        range [start, end) of log_file. The defaults are the whole file
+        If jobs > 1 then log_file is decoded in parallel by log_file_to_df_parallel()
+        Compressed log files are always decoded in a single process
+    """
+    if jobs > 1 and not is_compressed(log_file):
+        return log_file_to_df_parallel(log_file, extra, jobs, start, end)
+    header, columns = get_header_entries(log_file, extra, start, end)
+    df = columns_to_df(columns, extra)
+    if df is None:
         return None, None
-    entry_keys = ENTRY_KEYS if extra else ENTRY_KEYS_SIMPLE
-    for entry in entries:
-        assert len(entry) == len(entry_keys), '\n%s\n%s' % (entry, entry_keys)
-    try:        
-        df = DataFrame(entries, columns=entry_keys)
-    except Exception as e:
-        print 
-        print '!' * 80
-        print len(entries), type(entries[0])
-        print entry_keys
-        print '^' * 80
-        raise e
-    del entries
     return header, df
 
+    
+def columns_to_df(columns, extra):
+    """Returns a pandas DataFrame built from the column buffers returned by get_header_entries()
+        timestamp is datetime64, line is int32 and the CATEGORY_KEYS columns are categoricals
+    """
+    entry_keys = ENTRY_KEYS if extra else ENTRY_KEYS_SIMPLE
+    if not columns[0]:
+        return None
+    data = {}
+    for key, col in zip(entry_keys, columns):
+        if key == 'timestamp':
+            data[key] = parse_timestamps(col)
+        elif key == 'line':
+            data[key] = np.frombuffer(col, dtype=np.int32).copy()
+        elif key in CATEGORY_KEYS:
+            data[key] = pd.Categorical(col)
+        else:
+            data[key] = col
+    return DataFrame(data, columns=entry_keys)
+
+
+def concat_logs(df_list, **kwargs):
+    """pd.concat() for DataFrames returned by log_file_to_df() that keeps the CATEGORY_KEYS
+        columns categorical. pd.concat() converts categoricals with different categories to 
+        object columns
+        The DataFrames in df_list are updated to share categories
+    """
+    for key in CATEGORY_KEYS:
+        if not all(key in df.columns for df in df_list):
+            continue
+        categories = union_categoricals([df[key] for df in df_list]).categories
+        for df in df_list:
+            df[key] = df[key].cat.set_categories(categories)
+    return pd.concat(df_list, **kwargs)
+
 
 USEC = DateOffset(microseconds=1)
+# USEC as int64 nanoseconds, for the int64 view of a datetime64[ns] column
+USEC_NS = 1000
 
 def make_timestamps_unique(df):
     """Make all the timestamps in DataFrame df unique by making each
         timestamp at least 1 sec greater than timestamp of preceeding row.
         Preserves first and last timestamp.
+        
+        Works on the int64 nanosecond view of df.timestamp. Gives the same results as
+        make_timestamps_unique_loop()
+    """
+    ts = df['timestamp'].values.view(np.int64).copy()
+    n = len(ts)
+    
+    # Prevent first timestamp in this log overlapping last timestamp in previous log
+    ts[0] += USEC_NS
+    
+    # ts[i] = max(ts[i], ts[i-1] + USEC) for all but the last row, which is
+    #  ts - i*USEC = running max of (ts - i*USEC)
+    if n > 2:
+        steps = np.arange(n - 1, dtype=np.int64) * USEC_NS
+        ts[:n-1] = np.maximum.accumulate(ts[:n-1] - steps) + steps
+        
+        # Deal with the case where the last timestamp moved.
+        # ts[1:n-1] is now strictly increasing in steps of at least USEC so the rows that 
+        #  must be moved back are the run before the last row with ts[i] + (n-2-i)*USEC >= ts[n-1]
+        last = ts[n-1]
+        back = np.arange(n - 3, -1, -1, dtype=np.int64) * USEC_NS
+        k = 1 + np.searchsorted(ts[1:n-1] + back, last, side='left')
+        ts[k:n-1] = last - np.arange(n - 1 - k, 0, -1, dtype=np.int64) * USEC_NS
+        
+    df['timestamp'] = ts.view('datetime64[ns]')
+
+
+def make_timestamps_unique_loop(df):
+    """Row by row version of make_timestamps_unique(). Too slow for big logs. 
+        Kept to check make_timestamps_unique() against
     """
     # Prevent first timestamp in this log overlapping last timestamp in previous log
     df.ix[0,'timestamp'] += USEC 
@@ -196,11 +432,48 @@ def make_timestamps_unique(df):
         df.ix[i-1,'timestamp'] = df.ix[i,'timestamp'] - USEC
 
 
-def load_log(log_path, extra):
+def test_make_timestamps_unique(n_tests=100, max_len=50):
+    """Check make_timestamps_unique() against make_timestamps_unique_loop() on random 
+        timestamps with lots of repeats and some that go backwards. 
+        The test offsets are steps of -2, 0, +1 and +3 microseconds, which collide with the 
+        1 microsecond steps that make_timestamps_unique() adds, and steps of -1 and +1 
+        milliseconds, the resolution of log timestamps
+    """
+    np.random.seed(111)
+    start = Timestamp('2013-03-10 10:00:00').value
+    for _ in range(n_tests):
+        n = np.random.randint(1, max_len)
+        offsets = np.random.choice([-10**6, -2000, 0, 0, 0, 1000, 3000, 10**6], n)
+        ts = (start + np.cumsum(offsets)).view('datetime64[ns]')
+        df_vec = DataFrame({'timestamp': ts})
+        df_loop = DataFrame({'timestamp': ts.copy()})
+        make_timestamps_unique(df_vec)
+        make_timestamps_unique_loop(df_loop)
+        assert (df_vec.timestamp.values == df_loop.timestamp.values).all(), '\n%s\n%s' % (
+            df_vec, df_loop)
+
+
+def make_timestamps_after(df, after):
+    """Returns DataFrame df, whose index is strictly increasing timestamps, with timestamps 
+        moved forward by the least amount that makes them all later than timestamp after
+        Used to keep the entries appended to a log file after those loaded before
+    """
+    ts = df.index.values.view(np.int64)
+    floor = Timestamp(after).value + np.arange(1, len(ts) + 1, dtype=np.int64) * USEC_NS
+    if (ts >= floor).all():
+        return df
+    df.index = pd.DatetimeIndex(np.maximum(ts, floor).view('datetime64[ns]'), 
+                                name=df.index.name)
+    return df
+
+
+def load_log(log_path, extra, jobs=1, start=0, end=None):
     """Return a pandas DataFrame for all the valid log entry lines in log_file
         The index of the DataFrame are the uniqufied timestamps of the log entries
+        jobs is the number of processes used to decode log_path
+        Only the lines in byte range [start, end) are loaded. The defaults are the whole file
     """
-    header, df = log_file_to_df(log_path, extra)
+    header, df = log_file_to_df(log_path, extra, jobs=jobs, start=start, end=end)
     if df is None:
         return None, None
     make_timestamps_unique(df)
@@ -208,20 +481,196 @@ def load_log(log_path, extra):
     return header, df
 
 
+def _load_log_to_shard(params):
+    """Load bytes [start, end) of log file path with load_log() and save the DataFrame as
+        table part in shard_dir/progress.<process id>.h5. Each process has its own shard so 
+        each HDF5 file has one writer
+        If after is not None the timestamps are moved to after it with make_timestamps_after()
+        Returns header, summary, load time. summary is {'start', 'end', 'num', 'shard', 'part'} 
+        or None if there were no log entries
+        Process pool worker for LogSaver.load_logs()
+    """
+    path, extra, jobs, start, end, after, shard_dir, part = params
+    t0 = time.time()
+    header, df = load_log(path, extra, jobs=jobs, start=start, end=end)
+    if df is None:
+        return header, None, time.time() - t0
+    if after is not None:
+        df = make_timestamps_after(df, after)
+    shard = 'progress.%d.h5' % os.getpid()
+    store = HDFStore(os.path.join(shard_dir, shard))
+    try:
+        store.put(part, df, format='table')
+    finally:
+        store.close()
+    summary = {'start': df.index[0], 'end': df.index[-1], 'num': len(df), 'shard': shard, 
+               'part': part}
+    return header, summary, time.time() - t0
+
+
+# The first HEAD_BYTES bytes of a log file identify it. Log files start with timestamped lines 
+#  so these differ between log files and they don't change when a log file is appended to, 
+#  rotated, copied or compressed
+HEAD_BYTES = 4096
+
+def get_head_hash(head, head_size):
+    return hashlib.md5(head[:head_size]).hexdigest()
+
+
+def get_log_identity(path):
+    """Returns head, identity for log path
+        head: The first HEAD_BYTES bytes of the log
+        identity: {'inode', 'size', 'head_size', 'head_hash'} 
+            size is the uncompressed size of the log, None for gzip files whose sizes are only
+            known by reading them. head_hash is the md5 of its first head_size bytes. inode is 
+            0 for compressed logs and on Windows
+    """
+    head = read_log_head(path, HEAD_BYTES)
+    inode = 0 if is_compressed(path) else os.stat(path).st_ino
+    identity = {
+        'inode': inode,
+        'size': get_log_size(path),
+        'head_size': len(head),
+        'head_hash': get_head_hash(head, len(head))
+    }
+    return head, identity
+
+
+def get_complete_size(path, size):
+    """Returns the number of bytes in the first size bytes of uncompressed log path that are
+        in complete lines. A server that is writing to path may not have finished its last line
+        Compressed logs are complete. size is None for gzip files of unknown size
+    """
+    if is_compressed(path):
+        return size
+    with open(path, 'rb') as f:
+        pos = size
+        while pos > 0:
+            n = min(pos, 64 * 1024)
+            f.seek(pos - n)
+            i = f.read(n).rfind('\n')
+            if i >= 0:
+                return pos - n + i + 1
+            pos -= n
+    return 0
+
+
+# Lines that start with a timestamp and a level. Every line that RE_LOG_LINE decodes matches
+#  this so the summary of a log file counts all its log entries. It may also count a few lines
+#  that get_header_entries() drops
+RE_SUMMARY_LINE = re.compile(r'''^(\d{4}-\d{2}-\d{2}[^\S\n]+\d{2}:\d{2}:\d{2}(?:,\d{0,3})?)
+                                [^\S\n]+([a-zA-Z]+)[^\S\n]''', re.MULTILINE|re.VERBOSE)
+SUMMARY_BLOCK_SIZE = 1024 * 1024
+
+def get_log_summary(path, start=0, end=None):
+    """Returns a summary of the lines in byte range [start, end) of log path. The lines are
+        matched with RE_SUMMARY_LINE, which is much cheaper than decoding them
+        Summaries are {'first', 'last', 'levels', 'size', 'lines'}
+            first, last: Timestamps of the first and last log entries. None if there are none
+            levels: {level: number of log entries}
+            size, lines: Number of bytes and lines
+        start must be the start of a line. end=None means the end of the file
+    """
+    first = last = None
+    levels = {}
+    size = lines = 0
+    block = ''
+    with open_log(path) as f:
+        if start:
+            seek_log(f, start)
+        while end is None or start + size < end:
+            n = SUMMARY_BLOCK_SIZE if end is None else min(SUMMARY_BLOCK_SIZE, end - start - size)
+            block = f.read(n)
+            if not block:
+                break
+            # Only match whole lines
+            if not block.endswith('\n'):
+                block += f.readline()
+            size += len(block)
+            lines += block.count('\n')
+            matches = RE_SUMMARY_LINE.findall(block)
+            if not matches:
+                continue
+            if first is None:
+                first = matches[0][0]
+            last = matches[-1][0]
+            for _, level in matches:
+                levels[level] = levels.get(level, 0) + 1
+    if block and not block.endswith('\n'):
+        lines += 1
+    return {
+        'first': parse_timestamp(first) if first else None,
+        'last': parse_timestamp(last) if last else None,
+        'levels': levels,
+        'size': size,
+        'lines': lines
+    }
+
+
+def merge_summaries(summary0, summary1):
+    """Returns the summary of a byte range of a log file and the byte range after it from 
+        their summaries. Summaries in old history entries may only have first and last
+    """
+    levels = dict(summary0.get('levels', {}))
+    for level, n in summary1['levels'].items():
+        levels[level] = levels.get(level, 0) + n
+    return {
+        'first': summary0['first'] if summary0['first'] is not None else summary1['first'],
+        'last': summary1['last'] if summary1['last'] is not None else summary0['last'],
+        'levels': levels,
+        'size': summary0.get('size', 0) + summary1['size'],
+        'lines': summary0.get('lines', 0) + summary1['lines']
+    }
+
+
 class LogSaver:
     """
         self.directory : Directory structure for temp and saved files
         self.log_list : List of server.log files to process
         self.extra : True if log messages and thread ids are to be saved too
-        self.history_path : History of server.log conversions saved here
+        self.history_path : Snapshot of the history of server.log conversions saved here
+        self.journal_path : Changes to the history since the snapshot are appended here
         self.progress_store_path : HDF5 file that holds one DataFrame for each server.log file 
+            loaded before the progress store was sharded
+        The DataFrames for the log files are saved in shards temp/progress.<process id>.h5
         self.store_path : Final DataFrame of all server.log entries saved here
-        self.history : History of server.log conversions
+        self.history : History of server.log conversions. {key: entry} where entry is 
+            start, end, num, load_time, header : Of the log entries loaded so far
+            path : Where the log file was last loaded from
+            inode, size, head_size, head_hash : Identity of the log file. See get_log_identity()
+            offset : Number of bytes of the log file that have been loaded
+            parts : (shard, key) of the DataFrames in the progress store shards, one for each
+                    time the log file has been loaded. Keys in the progress store for log 
+                    files loaded before the progress store was sharded
+            summary : Summary of the bytes loaded so far. See get_log_summary()
+            Entries from before byte offsets were recorded only have the first 5 fields and 
+            are keyed by path
+        self.sizes_path : self.sizes is saved here
+        self.sizes : {path: (stamp, size)} of the gzip files in self.log_list that have been 
+            read to find their uncompressed sizes. See get_file_stamp()
+        self.jobs : Number of processes used to load the server.log files. See load_logs()
+        self.partitioned : True if the final DataFrame is also to be saved in a time-partitioned
+                           columnar store
+        self.parts_path : Time-partitioned columnar store of all server.log entries
     """
 
     FINAL = 'logs'
     PROGRESS = 'progress'
     HISTORY = 'history'
+    SIZES = 'gzip_sizes'
+    JOURNAL_EXT = '.journal'
+    
+    # The history journal is compacted into the history snapshot when it has this many records
+    JOURNAL_MAX_RECORDS = 1000
+    
+    # Columns of the final table that can be used in HDFStore.select() where clauses. 
+    #  The timestamp index is always queryable
+    DATA_COLUMNS = ['level', 'file', 'line', 'thread']
+    
+    # Categorical columns that are stored as strings in the final table. A table stores all the 
+    #  categories of a categorical column which costs far more than it saves when most of the 
+    #  values are unique, as thread names are
+    STRING_KEYS = ['thread']
 
     @staticmethod
     def normalize(name):
@@ -241,16 +690,23 @@ class LogSaver:
     #    temp = 'temp_%s%08X' % (sgn, abs(hsh))
     #    return LogSaver.make_name(temp, extra)    
 
-    def __init__(self, store_path, log_list, extra):
+    def __init__(self, store_path, log_list, extra, jobs=1, partitioned=False):
         self.directory = ObjectDirectory(store_path)
         self.log_list = tuple(sorted(log_list))
         self.extra = extra
+        self.jobs = jobs
+        self.partitioned = partitioned
 
         self.history_path = self.directory.get_path(LogSaver.HISTORY, temp=True)
         self.progress_store_path = self.directory.get_path(LogSaver.PROGRESS, temp=True, is_df=True)
         self.store_path = self.directory.get_path(LogSaver.make_name(LogSaver.FINAL, extra), 
                             is_df=True)
-        self.history = ObjectDirectory.load_object(self.history_path, {})
+        self.parts_path = self.directory.get_path(LogSaver.make_name(LogSaver.FINAL, extra), 
+                            partitioned=True)
+        self.journal_path = os.path.splitext(self.history_path)[0] + LogSaver.JOURNAL_EXT
+        self.history = self.load_history()
+        self.sizes_path = self.directory.get_path(LogSaver.SIZES, temp=True)
+        self.sizes = ObjectDirectory.load_object(self.sizes_path, {})
         self.saved = False
         
     def __repr__(self):
@@ -260,58 +716,189 @@ class LogSaver:
         return '\n'.join([repr(self), '%d log files' % len(self.log_list)])    
 
     def save_all_logs(self, force=False):
+        """Load the parts of the log files in self.log_list that haven't been loaded and save
+            them to the progress store then save all the log files in self.log_list to the 
+            final store
+            The final store is only rebuilt if there are new parts
+        """
          
+        tasks, keys = self.get_tasks()
         if os.path.exists(self.store_path):
-            final_store = HDFStore(self.store_path)
-            print 'Keys: %s' % final_store
-            final_store.close()
-            return
-        if not force:
-            assert not os.path.exists(self.history_path), '''
+            if not tasks:
+                final_store = HDFStore(self.store_path)
+                print 'Keys: %s' % final_store
+                final_store.close()
+                return
+            print '%d log files have new bytes. Updating %s' % (len(tasks), self.store_path)
+        elif not force:
+            assert not (os.path.exists(self.history_path) 
+                        or os.path.exists(self.journal_path)), '''
                 %s exists but %s does not.
                 There appears to be a conversion in progress.
                 -f forces conversion to complete.
             ''' % (self.history_path, self.store_path)
         
+        # Overlapping log files are found before any time is spent loading them
+        self.check(self.get_summaries(keys, tasks))
+        
         self.directory.make_dir_if_necessary(self.progress_store_path)
-        self.progress_store = HDFStore(self.progress_store_path)
-        for path in self.log_list:
-            self.save_log(path)
+        for task, header, summary, load_time in self.load_logs(tasks):
+            self.save_log(task, header, summary, load_time)
         
-        self.check()    
         print '--------'
-        print 'All tables in %s' % self.progress_store_path
-        print self.progress_store.keys()
+        print 'Progress store shards: %s' % self.get_shard_paths()
         print '--------'
         
-        def get_log(path):
-            try:
-                return self.progress_store.get(LogSaver.normalize(path))
-            except Exception as e:
-                print
-                print path
-                raise e
-               
-        
-        df_list = [get_log(path) for path in self.log_list]     
-        self.progress_store.close()
-        print 'Closed %s' % self.progress_store_path
-        
-        df_all = pd.concat(df_list)
-        print 'Final list has %d entries' % len(df_all)
-        final_store = HDFStore(self.store_path)
-        final_store.put('logs', df_all)
-        print 'Keys: %s' % final_store
-        final_store.close()
-        print 'Closed %s' % self.store_path
+        # check() has verified that the logs don't overlap so appending them in order of first
+        #  timestamp gives a table in time order
+        summaries = self.get_summaries(key for key in keys if key in self.history)
+        # Log files without log entries have nothing to append
+        summaries = {key: summary for key, summary in summaries.items() 
+                     if summary['first'] is not None}
+        keys = sorted(summaries, key=lambda key: summaries[key]['first'])
+        self.progress_stores = {}
+        try:
+            self.save_final_store(keys, summaries)
+        finally:
+            for store in self.progress_stores.values():
+                store.close()
+        print 'Closed progress store shards'
         
         # Save the history in a corresponding file
+        self.compact_history()
         self.directory.save('history', self.history)
         print 'Saved history'
         
         self.saved = True
         
 
+    def get_summaries(self, keys, tasks=()):
+        """Returns {key: summary} for history keys with the bytes to be loaded for tasks 
+            added. The summaries of history entries from before summaries were recorded only 
+            have first and last, which are the entries' start and end
+        """
+        summaries = {}
+        for key in keys:
+            hist = self.history.get(key)
+            if hist:
+                summaries[key] = hist.get('summary', {'first': hist['start'], 
+                                                      'last': hist['end']})
+        for task in tasks:
+            key = task['key']
+            summaries[key] = (merge_summaries(summaries[key], task['summary']) 
+                              if key in summaries else task['summary'])
+        return summaries
+
+    def get_shard_paths(self):
+        """Returns the paths of the progress store and its shards"""
+        return sorted(glob.glob(os.path.join(self.directory.get_dir(temp=True), 'progress*.h5')))
+
+    def get_parts(self, key):
+        """Returns (store path, store key) of the DataFrames for history entry key in the 
+            order they were loaded
+        """
+        temp_dir = self.directory.get_dir(temp=True)
+        parts = self.history[key].get('parts', [LogSaver.normalize(key)])
+        return [(os.path.join(temp_dir, part[0]), part[1]) if isinstance(part, tuple) 
+                else (self.progress_store_path, part) 
+                for part in parts]
+
+    def get_part(self, store_path, part, columns=None):
+        """Returns the DataFrame saved as part in progress store shard store_path. 
+            Shards are kept open in self.progress_stores
+            Parts saved before the progress store was sharded are in fixed format with object
+            columns and an int64 line. They are read whole and converted to the column types 
+            of columns_to_df() 
+        """
+        if store_path not in self.progress_stores:
+            self.progress_stores[store_path] = HDFStore(store_path, mode='r')
+        store = self.progress_stores[store_path]
+        if store.get_storer(part).is_table:
+            return store.select(part, columns=columns)
+        df = store.select(part)
+        for key in CATEGORY_KEYS:
+            if key in df.columns:
+                df[key] = df[key].astype('category')
+        if 'line' in df.columns:
+            df['line'] = df['line'].astype(np.int32)
+        return df[columns] if columns is not None else df
+
+    def get_column_info(self, keys):
+        """Returns categories, itemsizes for the DataFrames for history keys in the progress 
+            store
+            categories: {column: sorted categories} for the categorical columns of the final
+                        table
+            itemsizes: {column: longest value} for the string columns of the final table
+            Only these columns are read
+        """
+        entry_keys = ENTRY_KEYS if self.extra else ENTRY_KEYS_SIMPLE
+        category_keys = [key for key in CATEGORY_KEYS if key in entry_keys]
+        string_keys = [key for key in entry_keys if key in LogSaver.STRING_KEYS or key == 'params']
+        values = {key: set() for key in category_keys}
+        itemsizes = {key: 1 for key in string_keys}
+        for store_path, part in sum((self.get_parts(key) for key in keys), []):
+            df = self.get_part(store_path, part, columns=category_keys + 
+                                [key for key in string_keys if key not in category_keys])
+            for key in category_keys:
+                values[key].update(df[key].cat.categories)
+            for key in string_keys:
+                if key not in category_keys and len(df):
+                    itemsizes[key] = max(itemsizes[key], df[key].str.len().max())
+        for key in string_keys:
+            if key in category_keys and values[key]:
+                itemsizes[key] = max(len(v) for v in values[key])
+        categories = {key: sorted(values[key]) for key in category_keys if key not in string_keys}
+        return categories, itemsizes
+
+    def save_final_store(self, keys, summaries):
+        """Append the DataFrames for history keys in the progress store to the final store
+            One DataFrame is in memory at a time
+            summaries, {key: summary} for keys, is saved with the table. See load_summaries()
+            HDF5 tables have one set of categories for each categorical column and a fixed width
+            for each string column so these are found for all the DataFrames first
+            The final store is written to a temporary file that is renamed when complete so
+            that a partial final store is never mistaken for a complete one
+            If self.partitioned then the DataFrames are also appended to the partitioned store
+        """
+        categories, itemsizes = self.get_column_info(keys)
+        temp_store_path = self.store_path + '.temp'
+        if os.path.exists(temp_store_path):
+            os.remove(temp_store_path)
+        temp_parts_path = self.parts_path + '.temp'
+        if os.path.exists(temp_parts_path):
+            shutil.rmtree(temp_parts_path)
+        
+        final_store = HDFStore(temp_store_path, complevel=9, complib='blosc')
+        num = 0
+        for store_path, part in sum((self.get_parts(key) for key in keys), []):
+            df = self.get_part(store_path, part)
+            for key, values in categories.items():
+                df[key] = df[key].cat.set_categories(values)
+            for key in itemsizes:
+                if key in CATEGORY_KEYS:
+                    df[key] = df[key].astype(str)
+            final_store.append('logs', df, data_columns=LogSaver.DATA_COLUMNS, index=False,
+                               min_itemsize=itemsizes)
+            if self.partitioned:
+                append_partitioned_df(temp_parts_path, df)
+            num += len(df)
+            del df
+        print 'Final table has %d entries' % num
+        # A full optlevel=9 index needs a few hundred MB more memory to build
+        final_store.create_table_index('logs', optlevel=6, kind='medium')
+        final_store.get_storer('logs').attrs.summaries = summaries
+        print 'Keys: %s' % final_store
+        final_store.close()
+        if os.path.exists(self.store_path):
+            os.remove(self.store_path)
+        os.rename(temp_store_path, self.store_path)
+        print 'Closed %s' % self.store_path
+        if self.partitioned:
+            if os.path.exists(self.parts_path):
+                shutil.rmtree(self.parts_path)
+            os.rename(temp_parts_path, self.parts_path)
+            print 'Saved %s' % self.parts_path
+
     def test_store(self):    
         final_store = HDFStore(self.store_path)
         print '----'
@@ -324,84 +911,336 @@ class LogSaver:
         final_store.close()
 
     def cleanup(self): 
-        os.remove(self.progress_store_path)
-        os.remove(self.history_path)
+        for path in self.get_shard_paths():
+            os.remove(path)
+        for path in self.history_path, self.journal_path, self.sizes_path:
+            if os.path.exists(path):
+                os.remove(path)
+        
+    def load_history(self):
+        """Returns the history in the history snapshot updated by the records in the history 
+            journal
+            An incomplete last record, from an interrupted run, is removed from the journal
+        """
+        temp_path = self.history_path + '.temp'
+        if not os.path.exists(self.history_path) and os.path.exists(temp_path):
+            # compact_history() was interrupted between removing the old snapshot and renaming 
+            #  the new one, which is complete
+            print 'Restoring %s from %s' % (self.history_path, temp_path)
+            os.rename(temp_path, self.history_path)
+        history = ObjectDirectory.load_object(self.history_path, {})
+        self.n_journal_records = 0
+        if not os.path.exists(self.journal_path):
+            return history
+        with open(self.journal_path, 'r+b') as f:
+            good_size = 0
+            while True:
+                try:
+                    key, fields = pickle.load(f)
+                except Exception:
+                    break
+                history.setdefault(key, {}).update(fields)
+                good_size = f.tell()
+                self.n_journal_records += 1
+            if good_size < os.path.getsize(self.journal_path):
+                print 'Removing incomplete record from %s' % self.journal_path
+                f.truncate(good_size)
+        return history
+
+    def save_history_record(self, key, fields):
+        """Record that history entry key has been updated with dict fields by appending to the 
+            history journal
+            Records hold the new values of fields so replaying them more than once is harmless
+        """
+        with open(self.journal_path, 'ab') as f:
+            pickle.dump((key, fields), f, pickle.HIGHEST_PROTOCOL)
+        self.n_journal_records += 1
+        if self.n_journal_records >= LogSaver.JOURNAL_MAX_RECORDS:
+            self.compact_history()
+
+    def compact_history(self):
+        """Save the whole history in the history snapshot and empty the history journal
+            The new snapshot is written to a temp file that is renamed over the old one, which 
+            replaces it atomically on POSIX, so an interrupted compaction leaves either snapshot 
+            and the whole journal. The journal is only emptied once the new snapshot is in place
+        """
+        temp_path = self.history_path + '.temp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(self.history, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name == 'nt' and os.path.exists(self.history_path):
+            # os.rename() doesn't replace files on Windows. load_history() reads the temp file 
+            #  if this is interrupted before the rename
+            os.remove(self.history_path)
+        os.rename(temp_path, self.history_path)
+        if os.path.exists(self.journal_path):
+            open(self.journal_path, 'wb').close()
+        self.n_journal_records = 0
         
     def delete(self):
         os.remove(self.store_path)
 
-    def save_log(self, path):
-        """Return a pandas DataFrame for all the valid log entry lines in log_file
-            The index of the DataFrame are the uniqufied timestamps of the log entries
+    def get_history_index(self):
+        """Returns {head_size: {head_hash: [key]}} of the history entries with identities for 
+            match_history()
         """
-        if path in self.history:
-            return
-        
+        index = {}
+        for key, hist in self.history.items():
+            if 'head_hash' in hist:
+                index.setdefault(hist['head_size'], {}).setdefault(hist['head_hash'], 
+                                                                   []).append(key)
+        return index
+
+    def match_history(self, head, identity, index):
+        """Returns the key of the history entry for the log file with head and identity, as 
+            returned by get_log_identity(), or None if there isn't one
+            The log file must start with the same bytes as the entry's log file did and be at 
+            least as long as the part that was loaded. If two entries match then the one with 
+            the same inode is used
+            index is get_history_index(). Nearly all entries have the same head_size so head
+            is hashed about once
+        """
+        matches = []
+        for head_size, hashes in index.items():
+            if len(head) < head_size:
+                continue
+            matches.extend(key for key in hashes.get(get_head_hash(head, head_size), [])
+                           if identity['size'] is None 
+                               or identity['size'] >= self.history[key]['offset'])
+        if not matches:
+            return None
+        matches.sort(key=lambda key: self.history[key]['inode'] != identity['inode'])
+        return matches[0]
+
+    def get_tasks(self):
+        """Returns tasks, keys for the log files in self.log_list
+            tasks: [{'path', 'key', 'start', 'end', 'identity', 'summary'}] for the log files 
+                   with bytes that haven't been loaded. Bytes [start, end) of log file path are 
+                   to be loaded and saved in history entry key. summary is their summary
+            keys: History keys of the log files in self.log_list
+            
+            Log files are matched to history entries by their first bytes so log files that 
+            have been rotated, copied or compressed since they were loaded aren't loaded again
+            Only the bytes that have been appended to them since are loaded
+        """
+        tasks = {}
+        keys = set()
+        new_keys = {}
+        index = self.get_history_index()
+        for path in self.log_list:
+            if path in self.history and 'head_hash' not in self.history[path]:
+                # Loaded before byte offsets were recorded
+                keys.add(path)
+                continue
+            try:
+                head, identity = get_log_identity(path)
+            except Exception as e:
+                print 'Could not read %s: %s' % (path, e)
+                continue
+            key = self.match_history(head, identity, index)
+            if key is not None:
+                start = self.history[key]['offset']
+            else:    
+                # A log file may be in self.log_list more than once. e.g. server.log.1 and 
+                #  server.log.1.gz
+                key = new_keys.setdefault(identity['head_hash'], 
+                                          '%s#%s' % (path, identity['head_hash'][:12]))
+                start = 0
+            keys.add(key)
+            summary = None
+            if identity['size'] is None:
+                identity['size'], summary = self.get_gzip_size(path, start)
+            end = get_complete_size(path, identity['size'])
+            if end <= start or (key in tasks and tasks[key]['end'] >= end):
+                continue
+            if summary is None:
+                summary = get_log_summary(path, start, end)
+            tasks[key] = {'path': path, 'key': key, 'start': start, 'end': end, 
+                          'identity': identity, 'summary': summary}
+        self.directory.make_dir_if_necessary(self.sizes_path)
+        ObjectDirectory.save_object(self.sizes_path, self.sizes)
+        return sorted(tasks.values(), key=lambda task: task['path']), keys
+
+    def get_gzip_size(self, path, start):
+        """Returns size, summary for gzip log path
+            size: The uncompressed size of path
+            summary: get_log_summary() of bytes [start, size) of path or None if they weren't 
+                     read
+            gzip files are read to the end to find their sizes. Their sizes are kept in 
+            self.sizes so each is only read once
+        """
+        stamp = get_file_stamp(path)
+        if path in self.sizes and self.sizes[path][0] == stamp:
+            return self.sizes[path][1], None
+        summary = get_log_summary(path, start)
+        size = start + summary['size']
+        self.sizes[path] = stamp, size
+        return size, summary
+
+    def load_logs(self, tasks):
+        """Generator of task, header, summary, load time for tasks returned by get_tasks(). 
+            See _load_log_to_shard()
+            
+            If self.jobs > 1 and there is more than one task then the log files are loaded in
+            a pool of self.jobs processes, each of which saves its DataFrames in its own 
+            progress store shard. Otherwise the log files are loaded one at a time, each in 
+            self.jobs processes
+            This process is the only one that updates the history so a log file is only 
+            recorded as loaded after its DataFrame has been saved
+            Tasks whose summaries show no log entries are not loaded
+        """
+        temp_dir = self.directory.get_dir(temp=True)
+
+        for task in tasks:
+            if not task['summary']['levels']:
+                yield task, [], None, 0
+        tasks = [task for task in tasks if task['summary']['levels']]
+
+        def get_params(task, jobs):
+            hist = self.history.get(task['key'])
+            part = LogSaver.normalize(task['key'])
+            if hist and hist['parts']:
+                part = '%s__%d' % (part, len(hist['parts']))
+            after = hist['end'] if hist else None
+            return (task['path'], self.extra, jobs, task['start'], task['end'], after, 
+                    temp_dir, part)
+
+        if self.jobs > 1 and len(tasks) > 1:
+            # Biggest first so that the pool isn't left waiting for a big file at the end
+            tasks = sorted(tasks, key=lambda task: -task['summary']['size'])
+            pool = mp.Pool(min(self.jobs, len(tasks)))
+            try:
+                results = pool.imap(_load_log_to_shard, [get_params(task, 1) for task in tasks])
+                for task, result in zip(tasks, results):
+                    yield (task,) + result
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                yield (task,) + _load_log_to_shard(get_params(task, self.jobs))
+
+    def save_log(self, task, header, summary, load_time):
+        """Record a byte range of a log file, loaded and saved to a progress store shard for 
+            task by _load_log_to_shard(), in the history
+            Log files without log entries are recorded too, with start and end None, so that 
+            they aren't summarized and loaded again
+        """
+        path, key = task['path'], task['key']
         print 'Processing %s' % path,
-        start = time.time()
-        header, df = load_log(path, extra=self.extra)
-        if df is None:
-            print 'Could not process %s' % path
-            return
-        self.progress_store.put(LogSaver.normalize(path), df)
-        load_time = time.time() - start
+        is_new = key not in self.history
+        if is_new:
+            self.history[key] = {
+                'start': None,
+                'end': None,
+                'load_time': 0,
+                'num': 0,
+                'header': header,
+                'parts': [],
+                'summary': task['summary']
+            }
+        hist = self.history[key]
+        if not is_new and 'summary' in hist:
+            hist['summary'] = merge_summaries(hist['summary'], task['summary'])
         
-        self.history[path] = {
-            'start': df.index[0],
-            'end': df.index[-1],
-            'load_time': int(load_time),
-            'num': len(df),
-            'header': header
-        }
-        ObjectDirectory.save_object(self.history_path, self.history)
-        del df
-        print { k:v for k,v in self.history[path].items() if k != 'header' },
+        # The bytes may not have any log entries 
+        if summary is not None:
+            if hist['start'] is None:
+                hist['start'] = summary['start']
+            hist['parts'].append((summary['shard'], summary['part']))
+            hist['end'] = summary['end']
+            hist['num'] += summary['num']
+        
+        hist['load_time'] += int(load_time)
+        hist['path'] = path
+        hist['offset'] = task['end']
+        hist.update(task['identity'])
+        # header doesn't change after an entry is created
+        self.save_history_record(key, hist if is_new else 
+            {k: v for k, v in hist.items() if k != 'header'})
+        print { k:v for k,v in hist.items() if k not in ('header', 'parts', 'summary') },
         print '%d of %d' % (len(self.history), len(self.log_list))
 
-    def check(self):
-        history = ObjectDirectory.load_object(self.history_path, {})
-        sorted_keys = history.keys()
-        sorted_keys.sort(key=lambda k: history[k]['start'])
+    @staticmethod
+    def check(summaries):
+        """Check that the log files with summaries {key: summary} don't overlap in time
+            Only the summaries are used so this can be done before the log files are loaded
+        """
+        sorted_keys = sorted((key for key in summaries if summaries[key]['first'] is not None),
+                             key=lambda key: summaries[key]['first'])
         print '-' * 80
         print 'Time range by log file'
-        for i, path in enumerate(sorted_keys):
-            hist = history[path]
-            print '%2d: %s  ---  %s : %s' % (i, hist['start'], hist['end'], path)
+        for i, key in enumerate(sorted_keys):
+            summary = summaries[key]
+            print '%2d: %s  ---  %s : %s' % (i, summary['first'], summary['last'], key)
         
-        path0 = sorted_keys[0]
-        for path1 in sorted_keys[1:]:
-            hist0,hist1 = history[path0],history[path1] 
-            assert hist0['end'] < hist1['start'], '''
+        # make_timestamps_unique() moves the first timestamp of each log file 1 sec later so 
+        #  consecutive log files may share a timestamp
+        for key0, key1 in zip(sorted_keys, sorted_keys[1:]):
+            summary0, summary1 = summaries[key0], summaries[key1]
+            assert summary0['last'] <= summary1['first'], '''
             -----------
             %s %s
-            start: %s
-            end  : %s
+            first: %s
+            last : %s
             -----------
             %s %s
-            hist1['start']
-            start: %s
-            end  : %s
+            first: %s
+            last : %s
             ''' % (
-                path0, hist0, hist0['start'],  hist0['end'],
-                path1, hist1, hist1['start'],  hist1['end'])    
+                key0, summary0, summary0['first'], summary0['last'],
+                key1, summary1, summary1['first'], summary1['last'])    
  
 
-def load_log_pattern(hdf_path, path_pattern, force=False, clean=False, extra=False, n_files=-1):  
+def load_summaries(hdf_path, extra=False):
+    """Returns {history key: summary} for the log files in the final store for hdf_path, as
+        saved by LogSaver.save_final_store(), without reading any log entries. See 
+        get_log_summary() for the summaries. Final stores saved before summaries were recorded
+        give {}
+    """
+    store_path = ObjectDirectory(hdf_path).get_path(LogSaver.make_name(LogSaver.FINAL, extra), 
+                                                    is_df=True)
+    final_store = HDFStore(store_path, mode='r')
+    try:
+        return getattr(final_store.get_storer(LogSaver.FINAL).attrs, 'summaries', {})
+    finally:
+        final_store.close()
+
 
+# Members of zip archives with names matching this are loaded
+LOG_MEMBER_PATTERN = 'server.log*'
+
+def get_log_paths(path_pattern, n_files=-1):
+    """Returns the paths of the first n_files log files matching path_pattern. n_files < 0 
+        means all of them
+        path_pattern is a glob pattern or a list of glob patterns. Zip archives that match are
+        replaced by their members that match LOG_MEMBER_PATTERN
+    """
     print path_pattern
     
-    path_list = glob.glob(path_pattern) 
+    patterns = path_pattern if isinstance(path_pattern, (list, tuple)) else [path_pattern]
+    path_list = expand_archives(sum((glob.glob(pattern) for pattern in patterns), []), 
+                                LOG_MEMBER_PATTERN)
     path_list = [path for path in path_list 
-                    if not path.lower().endswith('.zip')
-                        and path.lower().count('log') == 1]
+                    if os.path.basename(path).lower().count('log') == 1]
     print path_list
-    if not path_list:
-        return False
 
     if n_files >= 0:
         path_list = path_list[:n_files]
+    return path_list
+
+
+def load_log_pattern(hdf_path, path_pattern, force=False, clean=False, extra=False, n_files=-1,
+        jobs=1, partitioned=False):  
+    """Load the log files matching path_pattern into HDF5 store hdf_path
+        See get_log_paths() for path_pattern and n_files
+    """
+    path_list = get_log_paths(path_pattern, n_files)
+    if not path_list:
+        return False
 
-    log_saver = LogSaver(hdf_path, path_list, extra=extra)
+    log_saver = LogSaver(hdf_path, path_list, extra=extra, jobs=jobs, partitioned=partitioned)
     print
     print log_saver
     print
@@ -415,6 +1254,196 @@ def load_log_pattern(hdf_path, path_pattern, force=False, clean=False, extra=Fal
     return log_saver.saved
 
 
+def test_load_old_history(n_entries=2000):
+    """Check that load_log_pattern() completes a conversion that was started before byte 
+        offsets were recorded when a new log file has been added. The old log file's history 
+        entry is keyed by its path and its DataFrame is in progress.h5 in fixed format with 
+        object columns and an int64 line, as they were saved then
+    """
+    import tempfile
+    work_dir = tempfile.mkdtemp()
+    root = ObjectDirectory.ROOT
+    try:
+        ObjectDirectory.ROOT = os.path.join(work_dir, 'data')
+        log_pattern = os.path.join(work_dir, 'server.log*')
+        old_path, new_path = [os.path.join(work_dir, name) for name in ('server.log.1', 'server.log')]
+        start = Timestamp('2013-03-10 10:00:00')
+        for i, path in enumerate([old_path, new_path]):
+            with open(path, 'wb') as f:
+                for j in range(n_entries):
+                    t = start + DateOffset(hours=i, seconds=j)
+                    f.write('%s,%03d %s JobManager:%d - Message %d [thread-%d]\n' % (
+                            t.strftime('%Y-%m-%d %H:%M:%S'), j % 1000, 
+                            ['INFO', 'DEBUG', 'ERROR'][j % 3], j % 7, j, j % 5))
+
+        log_saver = LogSaver('old_history', [old_path], extra=False)
+        header, df = load_log(old_path, False)
+        for key in df.columns:
+            df[key] = df[key].astype(np.int64 if key == 'line' else object)
+        log_saver.directory.make_dir_if_necessary(log_saver.progress_store_path)
+        store = HDFStore(log_saver.progress_store_path)
+        try:
+            store.put(LogSaver.normalize(old_path), df)
+        finally:
+            store.close()
+        ObjectDirectory.save_object(log_saver.history_path, {old_path: {
+            'start': df.index[0], 'end': df.index[-1], 'num': len(df), 'load_time': 0,
+            'header': header}})
+
+        # The old conversion is in progress so it has to be forced to complete
+        assert load_log_pattern('old_history', log_pattern, force=True)
+        logs = pd.read_hdf(log_saver.store_path, LogSaver.FINAL)
+        assert len(logs) == 2 * n_entries, len(logs)
+        assert logs.index.is_monotonic_increasing and logs.index.is_unique
+        assert (logs.index[:n_entries] == df.index).all()
+        assert (logs.level.astype(str).values[:n_entries] == df.level.values).all()
+        assert (logs.line.values[:n_entries] == df.line.values).all()
+    finally:
+        ObjectDirectory.ROOT = root
+        shutil.rmtree(work_dir)
+
+
+def _load_log_df(params):
+    """Returns header, DataFrame for bytes [0, end) of log file path
+        Process pool worker for load_log_pattern_df()
+    """
+    path, extra, jobs, end = params
+    return load_log(path, extra, jobs=jobs, end=end)
+
+
+def get_ordered_logs(path_pattern, n_files=-1):
+    """Returns path_list, ends, summaries for the log files matching path_pattern. See 
+        get_log_paths() for path_pattern and n_files
+            path_list: The paths of the log files with log entries in time order
+            ends: {path: number of bytes in complete lines}
+            summaries: {path: get_log_summary() of the complete lines}
+        Log files are matched and checked as in LogSaver.save_all_logs()
+    """
+    # A log file may be matched more than once. e.g. server.log.1 and server.log.1.gz
+    #  {head hash: (path, end, summary)} of the longest copy of each log file
+    copies = {}
+    for path in get_log_paths(path_pattern, n_files):
+        try:
+            _, identity = get_log_identity(path)
+        except Exception as e:
+            print 'Could not read %s: %s' % (path, e)
+            continue
+        summary = None
+        if identity['size'] is None:
+            # gzip files are read to the end to find their sizes
+            summary = get_log_summary(path)
+            identity['size'] = summary['size']
+        end = get_complete_size(path, identity['size'])
+        head_hash = identity['head_hash']
+        if head_hash not in copies or copies[head_hash][1] < end:
+            copies[head_hash] = path, end, summary
+    ends = {path: end for path, end, _ in copies.values()}
+
+    summaries = {path: summary if summary is not None else get_log_summary(path, 0, end) 
+                 for path, end, summary in copies.values()}
+    LogSaver.check(summaries)
+    path_list = sorted((path for path in summaries if summaries[path]['levels']), 
+                       key=lambda path: summaries[path]['first'])
+    return path_list, ends, summaries
+
+
+def load_log_pattern_df(path_pattern, extra=False, n_files=-1, jobs=1):
+    """Returns history, DataFrame of the log entries in the log files matching path_pattern, 
+        in time order, or None, None if there are none. See get_ordered_logs() for the log files
+        history is {path: entry} for the log files with log entries. The entries have the 
+            start, end, num, header, path, offset and summary fields of LogSaver.history
+        This is load_log_pattern() for callers that use the log entries once. Nothing is 
+        written to disk and nothing loaded before is reused
+        If jobs > 1 then the log files are loaded in a pool of jobs processes
+    """
+    path_list, ends, summaries = get_ordered_logs(path_pattern, n_files)
+    
+    if jobs > 1 and len(path_list) > 1:
+        pool = mp.Pool(min(jobs, len(path_list)))
+        try:
+            results = pool.map(_load_log_df, [(path, extra, 1, ends[path]) for path in path_list])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_load_log_df((path, extra, jobs, ends[path])) for path in path_list]
+        
+    history = {}
+    df_list = []
+    for path, (header, df) in zip(path_list, results):
+        if df is None:
+            continue
+        history[path] = {
+            'start': df.index[0],
+            'end': df.index[-1],
+            'num': len(df),
+            'header': header,
+            'path': path,
+            'offset': ends[path],
+            'summary': summaries[path]
+        }
+        df_list.append(df)
+    if not df_list:
+        return None, None
+    return history, concat_logs(df_list)
+
+
+def count_log(path, end, counter):
+    """Add the log entries in bytes [0, end) of log file path to MinuteCounter counter"""
+    add = counter.add
+    pos = 0
+    with open_log(path) as f:
+        for line in f:
+            if pos >= end:
+                break
+            pos += len(line)
+            entry = decode_log_line_simple(line.rstrip('\r\n'))
+            if entry:
+                add(*entry)
+
+
+def _count_log(params):
+    """Returns a MinuteCounter with first, last of the log entries in bytes [0, end) of log 
+        file path
+        Process pool worker for count_log_pattern()
+    """
+    path, end, first, last = params
+    counter = MinuteCounter(first, last)
+    count_log(path, end, counter)
+    return counter
+
+
+def count_log_pattern(path_pattern, n_files=-1, jobs=1):
+    """Returns a minute_counts.MinuteCounter of the log entries in the log files matching 
+        path_pattern or None if there are none. See get_ordered_logs() for the log files
+        This is load_log_pattern_df() for callers that only need minute counts. The log 
+        entries are counted as they are decoded so memory use doesn't grow with the number of 
+        log entries
+        If jobs > 1 then the log files are counted in a pool of jobs processes
+    """
+    path_list, ends, summaries = get_ordered_logs(path_pattern, n_files)
+    if not path_list:
+        return None
+    # The summaries fix the bins before any log entries are decoded
+    first, last = summaries[path_list[0]]['first'], summaries[path_list[-1]]['last']
+    counter = MinuteCounter(first, last)
+    
+    if jobs > 1 and len(path_list) > 1:
+        pool = mp.Pool(min(jobs, len(path_list)))
+        try:
+            # Each worker's counter is merged as it arrives so that only a few are held at once
+            for other in pool.imap_unordered(_count_log, 
+                    [(path, ends[path], first, last) for path in path_list]):
+                counter.update(other)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for path in path_list:
+            count_log(path, ends[path], counter)
+    return counter
+
+
 def main():
     import optparse
     
@@ -430,9 +1459,16 @@ def main():
     parser.add_option('-c', '--clean', dest='clean', action='store_true', default=False, 
             help='Delete the in-progress (temp) files for this processing session.')        
     parser.add_option('-e', '--extra', dest='extra', action='store_true', default=False, 
-            help='Extra information mode. Stores log content and thread id')
+            help='Extra information mode. Stores log content, as templates and parameters, and thread id')
     parser.add_option('-n', '--number-files', dest='n_files', type='int', default=-1, 
             help='Max number of log files to process')            
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=1, 
+            help='Number of processes. Log files are loaded in a pool of this many processes. '
+                 'A single uncompressed log file is split into byte ranges that are decoded in '
+                 'this many processes')            
+    parser.add_option('-p', '--partitioned', dest='partitioned', action='store_true', 
+            default=False, 
+            help='Also save the log entries in a store partitioned by day. See common.py')
     options, args = parser.parse_args()
 
     if not options.hdf_path or not options.path_pattern:
@@ -442,7 +1478,8 @@ def main():
         exit()
  
     load_log_pattern(options.hdf_path, options.path_pattern, force=options.force,
-            clean=options.clean, extra=options.extra, n_files=options.n_files)
+            clean=options.clean, extra=options.extra, n_files=options.n_files, 
+            jobs=options.jobs, partitioned=options.partitioned)
 
 
 if __name__ == '__main__':
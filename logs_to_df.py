@@ -9,6 +9,7 @@ import re, sys, glob, os
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series, Timestamp, DateOffset
+from load_logs import USEC_NS
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
@@ -93,15 +94,14 @@ def log_file_to_df(log_file):
     entries = [e for e in get_entries(log_file)]
     return DataFrame(entries, columns = ['logfile', 'logline'] + ENTRY_KEYS)
 
-USEC = DateOffset(microseconds=1)
-
 def make_timestamps_unique(df):
     """Make all the timestamps in DataFrame df unique by making each
         timestamp at least 1 sec greater than timestamp of preceeding row
     """
-    for i in range(1, len(df)):
-        if df.ix[i,'timestamp'] <= df.ix[i-1,'timestamp']:
-            df.ix[i,'timestamp'] = df.ix[i-1,'timestamp'] + USEC
+    ts = df['timestamp'].values.view(np.int64)
+    # ts[i] = max(ts[i], ts[i-1] + USEC)  <=>  ts - i*USEC = running max of (ts - i*USEC)
+    steps = np.arange(len(ts), dtype=np.int64) * USEC_NS
+    df['timestamp'] = (np.maximum.accumulate(ts - steps) + steps).view('datetime64[ns]')
 
 
 def load_log(log_file):
@@ -13,7 +13,11 @@ from __future__ import division
 
     @author: peter
 """
-import re, sys, os, glob, logging, optparse, copy, time, datetime
+import re, sys, os, glob, logging, optparse, copy, time, datetime, mmap, hashlib, bisect
+import cPickle as pickle
+import numpy as np
+from collections import OrderedDict
+from archives import is_compressed, read_log, get_archive_path, split_log_path, expand_archives
 
 KEY_TIMESTAMP = 'timestamp'
 KEY_LEVEL = 'level'
@@ -31,27 +35,93 @@ re_log_line2 = re.compile(pattern_log_line2, re.IGNORECASE|re.DOTALL)
 pattern_log_line3 = r'(?P<timestamp>\S{3} \d{2} \d{2}:\d{2}:\d{2}(,\d{0,3}){0,1})\s+(?P<level>ERROR|INFO|DEBUG)\s*:\s+(?P<content>.*)'
 re_log_line3 = re.compile(pattern_log_line3, re.IGNORECASE|re.DOTALL)
 
-def decode_log_line(log_line):
+class LogFormat:
+    """ A log line format
+        regex : Compiled regular expression that matches log lines in this format 
+        entry_keys : Names of the groups in regex. These are the keys of the dicts returned
+            by decode()
+        family : Formats in the same family can match the same lines. They are always tried in
+            the order they were registered so a more specific format registered before a 
+            looser one is tried first. See detect_log_formats()
+    """
+    def __init__(self, name, regex, entry_keys, family=None):
+        self.name = name
+        self.regex = regex
+        self.entry_keys = entry_keys
+        self.family = family or name
+
+    def __repr__(self):
+        return 'LogFormat(%s)' % self.name
+
+    def decode(self, line):
+        """ Return a dict of the parts of line or None if line is not in this format """
+        m = self.regex.search(line)
+        if not m:
+            return None
+        return m.groupdict()
+
+# The registered log line formats. decode_log_line() tries them in this order
+LOG_FORMATS = []
+
+def register_log_format(name, regex, entry_keys, family=None):
+    """ Register a new log line format. Returns the LogFormat 
+        Formats that can match the same lines must have the same family and the more specific
+        ones must be registered first
+    """
+    log_format = LogFormat(name, regex, entry_keys, family)
+    LOG_FORMATS.append(log_format)
+    return log_format
+
+register_log_format('server', re_log_line, ENTRY_KEYS)
+register_log_format('print-provider', re_log_line2, ENTRY_KEYS, family='print-provider')
+# No thread id in this pattern. It also matches the lines of the pattern above
+register_log_format('print-provider-no-thread', re_log_line3, ENTRY_KEYS2, family='print-provider')
+
+# Number of lines at the start of a log file that are used to detect its format
+N_FORMAT_SAMPLE_LINES = 1000
+
+def detect_log_formats(log_lines):
+    """ Return LOG_FORMATS reordered so that the families of the formats that match lines in a 
+        sample of log_lines come first. Pass the result to decode_log_line() so that lines in a
+        file's format don't pay for failed matches against other formats
+        Formats stay in registration order within the detected and undetected families so a
+        line is decoded by the same format as with LOG_FORMATS, even when the sample only 
+        matches a looser format in a family
+    """
+    sample = log_lines[:N_FORMAT_SAMPLE_LINES]
+    families = set(fmt.family for fmt in LOG_FORMATS 
+                   if any(fmt.regex.search(line) for line in sample))
+    detected = [fmt for fmt in LOG_FORMATS if fmt.family in families]
+    return detected + [fmt for fmt in LOG_FORMATS if fmt.family not in families]
+
+def decode_log_line(log_line, log_formats=None):
     """ Split a PaperCut print-provider.log line into its parts. 
         See pattern_log_line for the parts
+        log_formats are the formats to try in order. Defaults to LOG_FORMATS. Use 
+            detect_log_formats() to put a file's format first
         No parts => not a formatted log line
     """
     line = log_line.strip('\n').strip()
-    m = re_log_line.search(line)
-    result = {}
-    entry_keys = ENTRY_KEYS
-    if not m:
-        m = re_log_line2.search(line)
-        #print '!',
-    if not m:
-        m = re_log_line3.search(line)
-        # No thread id in this pattern
-        entry_keys = ENTRY_KEYS2        
-    if m:
-        for k in entry_keys:
-            #print '%10s :' % k, m.group(k)
-            result[k] = m.group(k)
-    return result
+    for log_format in log_formats or LOG_FORMATS:
+        result = log_format.decode(line)
+        if result:
+            return result
+    return {}
+    
+def test_detect_log_formats(n_sample=N_FORMAT_SAMPLE_LINES):
+    """ Check that lines are decoded by the same formats with detect_log_formats() as with 
+        LOG_FORMATS in a print-provider log whose sample only has lines without thread ids.
+        The later lines with thread ids must still be decoded by the print-provider format
+    """
+    log_lines = ['Jul 01 13:%02d:%02d INFO : Registering printer %d' % (i // 60 % 60, i % 60, i) 
+                 for i in xrange(n_sample)]
+    log_lines += ['Jul 01 14:00:%02d ERROR: Failed to print job %d [thread-%d]' % (i, i, i) 
+                  for i in xrange(5)]
+    log_formats = detect_log_formats(log_lines)
+    assert log_formats[0].name == 'print-provider', log_formats
+    for line in log_lines:
+        assert decode_log_line(line, log_formats) == decode_log_line(line), line
+    assert decode_log_line(log_lines[-1], log_formats)[KEY_THREAD] == 'thread-4'
     
 def encode_log_entry(entry):
     return '%s %s %s [%s]' % (entry[KEY_TIMESTAMP], entry[KEY_LEVEL], entry[KEY_CONTENT], entry[KEY_THREAD])
@@ -91,29 +161,73 @@ if False:
         print result
     exit()
 
-def read_log_gen(f):
-    """ Generator to read a line of data from PaperCut log file """
-    while True:
-        line = f.readline()
-        if not line:
-            break
-        yield line.rstrip('\n').strip()    
-
-def _read_log_lines(log_file):
-    f = open(log_file, 'rt')
-    if not f:
-        print 'Could not open', log_file
-        return None,
-    log_lines = []
-    for line in read_log_gen(f):
-        log_lines.append(line)
-    f.close() 
-    return log_lines
+# Number of bytes of data that get_line_offsets() scans for line ends at a time
+LINE_SCAN_BYTES = 64 * 1024 * 1024
+
+def get_line_offsets(data):
+    """ Return an int64 numpy array of the offsets of the starts of the lines in data followed 
+        by len(data) 
+        data is a string or an mmap
+    """
+    n = len(data)
+    chunks = [np.zeros(1, dtype=np.int64)]
+    for start in xrange(0, n, LINE_SCAN_BYTES):
+        chunk = np.frombuffer(data[start:start + LINE_SCAN_BYTES], dtype=np.uint8)
+        chunks.append(np.flatnonzero(chunk == ord('\n')).astype(np.int64) + (start + 1))
+    offsets = np.concatenate(chunks)
+    if offsets[-1] != n:
+        offsets = np.append(offsets, np.int64(n))
+    return offsets
+
+class LogLines:
+    """ Read-only sequence of the stripped lines of a PaperCut log file
+        The file is memory-mapped and lines are read on demand using an index of the offsets
+        of the line starts, so only the index is kept in memory
+        Compressed log files (see archives.py) can't be memory-mapped so they are 
+        decompressed into memory
+    """
+    def __init__(self, log_file):
+        self.log_file = log_file
+        if is_compressed(log_file):
+            self._data = read_log(log_file)
+            self.offsets = get_line_offsets(self._data)
+            return
+        f = open(log_file, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Can't mmap an empty file
+                self._data = ''
+        finally:
+            f.close()
+        self.offsets = get_line_offsets(self._data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in xrange(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('line %d of %s' % (i, self.log_file))
+        return self._data[self.offsets[i]:self.offsets[i+1]].strip()
+
+    def __iter__(self):
+        # Offsets are converted to ints a block at a time as indexing numpy arrays is slow
+        data, n, block = self._data, len(self), 64 * 1024
+        for i in xrange(0, n, block):
+            offsets = self.offsets[i:min(i + block, n) + 1].tolist()
+            for j in xrange(len(offsets) - 1):
+                yield data[offsets[j]:offsets[j+1]].strip()
     
 _verbose = False
 
 # !@#$ Should decode lines in cache!!!    
 class LogReaderCache:
+    """ Cache of LogLines for the log files that have been read """
     def __init__(self):
         self._cache = {}
         self._calls = 0
@@ -122,11 +236,9 @@ class LogReaderCache:
     def get(self, log_file):
         self._calls += 1
         if not self._cache.has_key(log_file):
-            log_lines = _read_log_lines(log_file)
-            if log_lines:
-                #print 'cache load: %s => %d lines' % (log_file, len(log_lines))
-                self._cache[log_file] = log_lines
-                self._misses += 1
+            #print 'cache load: %s' % log_file
+            self._cache[log_file] = LogLines(log_file)
+            self._misses += 1
         self.show_stats()        
         return self._cache[log_file]
         
@@ -141,28 +253,141 @@ def read_log_lines(log_file):
     global _log_reader_cache
     return _log_reader_cache.get(log_file)
    
+def decode_log_file(log_file):
+    """ Return the decoded log entries of all the log entry lines in log_file and the line
+        numbers of those lines
+    """
+    log_lines = read_log_lines(log_file)
+    log_formats = detect_log_formats(log_lines)
+    log_entries, line_numbers = [], []
+    for i, line in enumerate(log_lines):
+        entry = decode_log_line(line, log_formats)
+        if entry.has_key(KEY_LEVEL):
+            log_entries.append(entry)
+            line_numbers.append(i)
+    return log_entries, line_numbers
+
+def get_file_key(log_file):
+    """ Return a key that identifies the current contents of log_file """
+    st = os.stat(get_archive_path(log_file))
+    return os.path.abspath(log_file), st.st_size, st.st_mtime
+
+# Rough memory used by a decoded log entry in addition to the characters in its strings
+ENTRY_OVERHEAD_BYTES = 400
+
+def get_entries_size(log_entries):
+    """ Return an estimate of the memory used by log_entries """
+    return sum(ENTRY_OVERHEAD_BYTES + sum(len(v) for v in x.itervalues()) for x in log_entries)
+
+# Default directory of the on-disk decoded log entry cache
+DECODER_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.map_logs_cache')
+# Default memory budget of the in-memory decoded log entry cache
+DECODER_CACHE_MB = 500
+
 class LogDecoderCache:
-    def __init__(self):
-        self._cache = {}
+    """ Cache of the decoded log entries of log files
+        
+        Two layers
+            memory: The least recently used files are evicted when the estimated size of the
+                cached entries exceeds max_bytes
+            disk: The entries of each file are pickled in cache_dir and are reused while the
+                file's path, size and modification time are unchanged. 
+                No disk cache if cache_dir is None
+    """
+    def __init__(self, cache_dir=DECODER_CACHE_DIR, max_bytes=DECODER_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # {log_file: (log_entries, line_numbers, estimated size)} in least recently used order
+        self._cache = OrderedDict()
+        self._bytes = 0
         self._calls = 0
         self._misses = 0
+        self._disk_hits = 0
+        self._evictions = 0
     
     def get(self, log_file):
+        """ Return the decoded log entries of log_file """
+        return self.get_with_line_numbers(log_file)[0]
+
+    def get_with_line_numbers(self, log_file):
+        """ Return the decoded log entries of log_file and the numbers of the lines they were
+            decoded from
+        """
         self._calls += 1
-        if not self._cache.has_key(log_file):
-            log_lines = read_log_lines(log_file)
-            log_entries = [decode_log_line(line) for line in log_lines]
-            log_entries = [x for x in log_entries if x.has_key(KEY_LEVEL)] 
-            if log_entries:
-                #print 'cache load: %s => %d lines' % (log_file, len(log_lines))
-                self._cache[log_file] = log_entries
+        if self._cache.has_key(log_file):
+            # Move to the most recently used end
+            log_entries, line_numbers, size = self._cache.pop(log_file)
+            self._cache[log_file] = log_entries, line_numbers, size
+        else:
+            key = get_file_key(log_file)
+            decoded = self._load(key)
+            if decoded is None:
+                decoded = decode_log_file(log_file)
+                self._save(key, decoded)
                 self._misses += 1
+            else:
+                self._disk_hits += 1
+            log_entries, line_numbers = decoded
+            size = get_entries_size(log_entries)
+            self._cache[log_file] = log_entries, line_numbers, size
+            self._bytes += size
+            self._evict()
         self.show_stats()        
-        return self._cache[log_file]
+        return log_entries, line_numbers
+
+    def _evict(self):
+        """ Evict least recently used files until the cache is within budget. The most recently
+            used file is always kept
+        """
+        while self._bytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, _, size) = self._cache.popitem(last=False)
+            self._bytes -= size
+            self._evictions += 1
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, hashlib.md5(key[0]).hexdigest() + '.pkl')
+
+    def _load(self, key):
+        """ Return the (log entries, line numbers) saved on disk for key or None if there are none """
+        if not self.cache_dir:
+            return None
+        try:
+            f = open(self._get_path(key), 'rb')
+        except IOError:
+            return None
+        try:
+            saved_key, decoded = pickle.load(f)
+        except Exception:
+            # Corrupt or incompatible cache file. It will be rewritten
+            return None
+        finally:
+            f.close()
+        if saved_key != key or not isinstance(decoded, tuple):
+            # Files saved before line numbers were cached hold a list of entries 
+            return None
+        return decoded
+
+    def _save(self, key, decoded):
+        if not self.cache_dir:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self._get_path(key)
+        temp_path = path + '.temp'
+        f = open(temp_path, 'wb')
+        try:
+            pickle.dump((key, decoded), f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temp_path, path)
        
-    def show_stats(self):
-        if _verbose:
-            print 'Cache: calls=%d, misses=%d, hits=%d' % (self._calls, self._misses, self._calls-self._misses)   
+    def show_stats(self, force=False):
+        if _verbose or force:
+            print 'Decoder cache: calls=%d, memory hits=%d, disk hits=%d, misses=%d, evictions=%d, files=%d, bytes=%d' % (
+                self._calls, self._calls - self._disk_hits - self._misses, self._disk_hits, 
+                self._misses, self._evictions, len(self._cache), self._bytes)   
 
 # The global log decoder cache.   
 _log_decoder_cache = LogDecoderCache()  
@@ -171,6 +396,10 @@ def get_decoded_log_lines(log_file):
     global _log_decoder_cache
     return _log_decoder_cache.get(log_file)
 
+def get_decoded_log_lines_with_line_numbers(log_file):
+    global _log_decoder_cache
+    return _log_decoder_cache.get_with_line_numbers(log_file)
+
 def get_timedelta_seconds(td):
     return (td.microseconds + (td.seconds + td.days * 24 * 3600) * 10**6) / 10**6 
 
@@ -226,12 +455,23 @@ def get_time_gap_matches(log_entries, min_time_gap):
 def get_first_log_entry(log_file):
     """ Return the first log entry in potential log file log_file or None if there """
     log_lines = read_log_lines(log_file)
+    log_formats = detect_log_formats(log_lines)
     for line in log_lines:
-        entry = decode_log_line(line)
+        entry = decode_log_line(line, log_formats)
         if entry.has_key(KEY_LEVEL) and entry.has_key(KEY_CONTENT):
             return get_entry_datetime(entry)
     return None	
 
+def get_last_log_entry(log_file):
+    """ Return the datetime of the last log entry in log_file or None if there is none """
+    log_lines = read_log_lines(log_file)
+    log_formats = detect_log_formats(log_lines)
+    for i in xrange(len(log_lines) - 1, -1, -1):
+        entry = decode_log_line(log_lines[i], log_formats)
+        if entry.has_key(KEY_LEVEL) and entry.has_key(KEY_CONTENT):
+            return get_entry_datetime(entry)
+    return None
+
 def get_count(a_list):
     return sum([1 if x else 0 for x in a_list])
    
@@ -255,6 +495,131 @@ def show_sorted_log(log_file):
             print x[KEY_LEVEL], x[KEY_TIMESTAMP], x[KEY_CONTENT]
         exit()
     
+# Every TIME_INDEX_STEP'th log entry is recorded in a sparse time index
+TIME_INDEX_STEP = 1000
+    
+def get_time_index_path(log_file):
+    """ The sparse time index of log_file is kept in a hidden file next to log_file so that it
+        doesn't match log file masks like server.log*
+        The index of a zip archive member is kept next to the archive
+    """
+    archive, member = split_log_path(log_file)
+    dir, name = os.path.split(archive)
+    if member is not None:
+        name = '%s_%s' % (name, re.sub(r'[^a-zA-Z0-9.]', '_', member))
+    return os.path.join(dir, '.%s.tidx' % name)
+
+def build_time_index(log_file):
+    """ Return a sparse time index of log_file. This is a list of 
+            (byte offset, latest datetime before offset, earliest datetime at or after offset)
+        for the lines of every TIME_INDEX_STEP'th log entry. 
+        The latest/earliest datetimes are taken over all entries, so the index can be 
+        binary-searched even when log entries are not in time order
+        The index is built from the entries in the decoder cache, so log_file is decoded at 
+        most once
+    """
+    log_lines = read_log_lines(log_file)
+    log_entries, line_numbers = get_decoded_log_lines_with_line_numbers(log_file)
+    line_datetimes = []
+    for i, entry in zip(line_numbers, log_entries):
+        dt = get_entry_datetime(entry)
+        if dt is not None:
+            line_datetimes.append((i, dt))
+    if not line_datetimes:
+        return []
+    
+    earliest = [dt for _, dt in line_datetimes]
+    for j in xrange(len(earliest) - 2, -1, -1):
+        earliest[j] = min(earliest[j], earliest[j+1])
+    
+    index = []
+    latest = datetime.datetime.min
+    for j, (i, dt) in enumerate(line_datetimes):
+        if j % TIME_INDEX_STEP == 0:
+            index.append((int(log_lines.offsets[i]), latest, earliest[j]))
+        latest = max(latest, dt)
+    return index
+
+def get_time_index(log_file):
+    """ Return the sparse time index of log_file. It is built on first use and saved next
+        to log_file if that directory is writeable
+    """
+    key = get_file_key(log_file)
+    path = get_time_index_path(log_file)
+    try:
+        f = open(path, 'rb')
+        try:
+            saved_key, index = pickle.load(f)
+        finally:
+            f.close()
+        if saved_key == key:
+            return index
+    except Exception:
+        pass
+    
+    index = build_time_index(log_file)
+    try:
+        f = open(path, 'wb')
+        try:
+            pickle.dump((key, index), f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+    except IOError:
+        pass
+    return index
+
+def decode_log_lines_range(log_lines, log_formats, start, end, step=1, max_entries=None):
+    """ Return the decoded log entries in log_lines[start:end:step] 
+        If max_entries is not None then stop after max_entries entries
+    """
+    log_entries = []
+    for i in xrange(start, end, step):
+        if max_entries is not None and len(log_entries) >= max_entries:
+            break
+        entry = decode_log_line(log_lines[i], log_formats)
+        if entry.has_key(KEY_LEVEL):
+            log_entries.append(entry)
+    return log_entries
+
+def get_decoded_log_lines_in_time_range(log_file, first_time, last_time, n_context):
+    """ Return the decoded log entries of log_file that may be in [first_time, last_time] plus 
+        n_context entries before and after them. 
+        Uses the sparse time index of log_file to find the lines to decode. Returns the cached
+        entries of the whole file if the time range doesn't exclude any index steps
+        first_time or last_time of None means no bound. The time index isn't built when the 
+        time range covers the first and last log entries 
+    """
+    if first_time is None:
+        first_time = datetime.datetime.min
+    if last_time is None:
+        last_time = datetime.datetime.max
+    first_dt = get_first_log_entry(log_file)
+    last_dt = get_last_log_entry(log_file)
+    if first_dt is None or (first_time <= first_dt and last_dt <= last_time):
+        return get_decoded_log_lines(log_file)
+
+    index = get_time_index(log_file)
+    if not index:
+        return get_decoded_log_lines(log_file)
+    
+    latest_before = [latest for _, latest, _ in index]
+    earliest_after = [earliest for _, _, earliest in index]
+    # All entries before index[lo] are earlier than first_time 
+    lo = max(0, bisect.bisect_left(latest_before, first_time) - 1)
+    # All entries at and after index[hi] are later than last_time 
+    hi = bisect.bisect_right(earliest_after, last_time)
+    if lo == 0 and hi == len(index):
+        return get_decoded_log_lines(log_file)
+    
+    log_lines = read_log_lines(log_file)
+    log_formats = detect_log_formats(log_lines)
+    start = int(log_lines.offsets.searchsorted(index[lo][0]))
+    end = int(log_lines.offsets.searchsorted(index[hi][0])) if hi < len(index) else len(log_lines)
+    
+    before = decode_log_lines_range(log_lines, log_formats, start - 1, -1, -1, n_context)
+    after = decode_log_lines_range(log_lines, log_formats, end, len(log_lines), 1, n_context)
+    return before[::-1] + decode_log_lines_range(log_lines, log_formats, start, end) + after
+
 def show_matches(log_file, levels_to_match, content_to_match, content_to_not_match, thread_id, lines_before, lines_after, 
                 match_plain, min_time_gap, first_time, last_time): 
     """ Decode a log file """
@@ -263,7 +628,10 @@ def show_matches(log_file, levels_to_match, content_to_match, content_to_not_mat
         print ' ' * 4, 'first_time:',first_time, ',last_time:', last_time
         print ' ' * 4, 'thread_id=', thread_id, 'lines_before=', lines_before, ' lines_after=',  lines_after
 
-    log_entries = get_decoded_log_lines(log_file) 
+    # Only decode the entries that may be in the time range and those that may be needed for
+    #  context and time gaps
+    log_entries = get_decoded_log_lines_in_time_range(log_file, first_time, last_time, 
+                                                      lines_before + lines_after + 1) 
     #log_lines = read_log_lines(log_file)
     #if not log_lines:
     #    return
@@ -324,7 +692,8 @@ def show_matches(log_file, levels_to_match, content_to_match, content_to_not_mat
 
 if __name__ == '__main__':
 
-    parser = optparse.OptionParser('usage: python ' + sys.argv[0] + ' [options] <input file>')
+    parser = optparse.OptionParser('usage: python ' + sys.argv[0] + ' [options] <input file>\n' +
+        '    <input file> is a file mask. It may match .gz files and .zip archives')
     parser.add_option('-E', '--error', action='store_true', dest='show_error', default=False, help='show ERROR lines')
     parser.add_option('-I', '--info', action='store_true', dest='show_info', default=False, help='show INFO lines')
     parser.add_option('-D', '--debug', action='store_true', dest='show_debug', default=False, help='show DEBUG lines')
@@ -339,6 +708,10 @@ if __name__ == '__main__':
     parser.add_option('-l', '--last-time', dest='last_time', default='2099-01-01 00:00:00', help='last log time')
     parser.add_option('-v', '--version', action='store_true', dest='show_version', default=False, help='show print provider version')
     parser.add_option('-s', '--sort', action='store_true', dest='sort_file', default=False, help='sort log file by severity')
+    parser.add_option('--cache-dir', dest='cache_dir', default=DECODER_CACHE_DIR, help='directory of the decoded log entry cache')
+    parser.add_option('--no-cache', action='store_true', dest='no_cache', default=False, help='do not use the on-disk decoded log entry cache')
+    parser.add_option('--cache-mb', dest='cache_mb', type='int', default=DECODER_CACHE_MB, help='memory budget of the decoded log entry cache in MB')
+    parser.add_option('--cache-stats', action='store_true', dest='cache_stats', default=False, help='show decoded log entry cache statistics')
          
     (options, args) = parser.parse_args()
     if len(args) < 1:
@@ -350,9 +723,13 @@ if __name__ == '__main__':
         exit()
         
     print 'options:', options
+    _log_decoder_cache = LogDecoderCache(None if options.no_cache else options.cache_dir, 
+                                         options.cache_mb * 1024 * 1024)
+
     # log_file is log file. It is read as text. 
     log_file_mask = args[0]
-    log_file_list_raw = [f for f in glob.glob(log_file_mask) if not os.path.isdir(f)]
+    # Zip archives are replaced by their members. Non-log files are removed below
+    log_file_list_raw = expand_archives([f for f in glob.glob(log_file_mask) if not os.path.isdir(f)])
     log_file_list_raw2 = [f for f in log_file_list_raw if get_first_log_entry(f) is not None]
     log_file_list = sorted(log_file_list_raw2, key=lambda x: get_first_log_entry(x))
     print 'log_file_mask =', log_file_mask
@@ -394,3 +771,6 @@ if __name__ == '__main__':
             int(options.lines_before), int(options.lines_after), options.match_plain, int(options.min_time_gap),
             get_datetime(options.first_time), get_datetime(options.last_time))        
 
+
+    if options.cache_stats:
+        _log_decoder_cache.show_stats(force=True)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+    Count log entries in the minute bins that preprocess_logs.py makes frequency series from
+
+    These are shared by preprocess_logs.py, which bins a DataFrame of log entries, and 
+    load_logs.py, which bins log entries with a MinuteCounter as they are decoded
+"""
+from __future__ import division
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Timestamp
+from datetime import datetime, timedelta
+
+
+def truncate_to_minutes(timestamp):
+    """Truncate a timestamp to the previous whole minute"""
+    return Timestamp(datetime(timestamp.year, timestamp.month, timestamp.day, timestamp.hour, 
+        timestamp.minute))
+
+
+# 1 sample/minute for a day    
+MAX_SAMPLES = 24 * 60    
+
+# Number of base_sec bins that counts are smoothed over
+SMOOTH_BINS = 6
+
+
+def get_bin_widths(start_time, end_time):
+    """Returns base_sec, sample_sec for preprocess_logs.get_minute_counts() over start_time to end_time
+        base_sec: Width of the bins that log entries are counted in
+        sample_sec: Width of the bins that the smoothed counts are summed into
+    """
+    assert start_time < end_time
+    duration = end_time - start_time
+    period_min = max(1, duration.total_seconds()/60/MAX_SAMPLES)
+    return int(period_min * 20.0), int(period_min * 60.0)
+
+    
+def smooth_bins(counts, base_sec, sample_sec):
+    """Returns the smoothed counts of a batch of series in sample_sec bins as a 2-D numpy array
+        counts: 2-D numpy array of the number of entries of each series (column) in base_sec
+                bin i (row) after an origin such as midnight 
+        Each series is smoothed over SMOOTH_BINS base_sec bins, as by pandas 
+        rolling(SMOOTH_BINS, center=True).mean(), then summed into sample_sec bins. Row j of 
+        the result is the sample_sec bin j after the origin, which holds the base_sec bins i 
+        with i * base_sec // sample_sec == j. Bins outside the sample_sec bins of the first 
+        and last entries of a series are NaN
+    """
+    n_bins, n_series = counts.shape
+    has_entries = counts > 0
+    first_bin = has_entries.argmax(axis=0)
+    last_bin = n_bins - 1 - has_entries[::-1].argmax(axis=0)
+    
+    # The smoothing is a convolution with a box of SMOOTH_BINS ones: Sums over bins [lo, hi) 
+    #  taken as differences of cumulative sums
+    cum = np.zeros((n_bins + 1, n_series), dtype=np.int64)
+    np.cumsum(counts, axis=0, out=cum[1:])
+    lo = np.arange(n_bins) - SMOOTH_BINS // 2
+    hi = lo + SMOOTH_BINS
+    smoothed = np.zeros((n_bins, n_series))
+    inside = np.flatnonzero((lo >= 0) & (hi <= n_bins))
+    if len(inside):
+        smoothed[inside[0]: inside[-1] + 1] = cum[SMOOTH_BINS:] - cum[:-SMOOTH_BINS]
+    del cum
+    smoothed /= SMOOTH_BINS
+    # Means over windows that reach outside a series' first to last bins are NaN in pandas 
+    #  and sums skip them
+    smoothed[(lo[:, np.newaxis] < first_bin) | (hi[:, np.newaxis] > last_bin + 1)] = 0.0
+    
+    sample_of_bin = np.arange(n_bins) * base_sec // sample_sec
+    starts = np.r_[0, np.flatnonzero(np.diff(sample_of_bin)) + 1]
+    samples = np.add.reduceat(smoothed, starts, axis=0)
+    j = np.arange(len(samples))[:, np.newaxis]
+    samples[(j < first_bin * base_sec // sample_sec) 
+            | (j > last_bin * base_sec // sample_sec)] = np.nan
+    return samples
+
+
+
+def get_time_range(first, last):
+    """Returns start_time, end_time that preprocess_logs.preprocess() uses for log entries with timestamps 
+        from first to last: Whole minutes at least 2 minutes inside them
+    """
+    return (truncate_to_minutes(first + timedelta(minutes=2)), 
+            truncate_to_minutes(last - timedelta(minutes=2)))
+
+
+def smooth_bin_counts(counts, keys, midnight, start_time, end_time):
+    """Returns the preprocess_logs.get_minute_counts() of keys as a DataFrame with one column 
+        per key. See preprocess_logs.get_minute_counts_grouped()
+        counts: 2-D numpy array of the number of entries of each key (column) in each base_sec 
+                bin after midnight (row)
+    """
+    base_sec, sample_sec = get_bin_widths(start_time, end_time)
+    if not counts.size:
+        return DataFrame(columns=keys, index=pd.DatetimeIndex([], name='timestamp'))
+    samples = smooth_bins(counts, base_sec, sample_sec)
+    index = pd.DatetimeIndex(midnight.value + np.arange(len(samples)) * sample_sec * 10**9,
+                             name='timestamp')
+    counts = DataFrame(samples, index=index, columns=keys)
+    return counts[start_time: end_time].dropna(how='all')
+
+
+class MinuteCounter:
+    """Counts log entries by level and by file:line in the base_sec bins of 
+        preprocess_logs.get_minute_counts() as they are decoded so that minute counts can be 
+        made without a DataFrame of the log entries. Memory use is the number of keys times the number of bins
+        
+        first, last: Timestamps of the first and last log entries. These fix the bins. 
+                     load_logs.get_log_summary() gives them without decoding the log files
+        e.g. 
+            counter = MinuteCounter(first, last)
+            for timestamp, level, file, line in entries:
+                counter.add(timestamp, level, file, line)
+            counter.get_lfl_counts(min_count)
+        gives the same DataFrame as 
+            preprocess_logs.get_minute_counts_grouped(df, ['file', 'line'], start_time, end_time, 
+                                                      min_count)
+        for a DataFrame df of the same entries, with its columns in sorted order. 
+        See load_logs.count_log_pattern()
+        
+        self.start_time, self.end_time : See get_time_range()
+        self.midnight : Start of the day of first. Bins are counted from here
+        self.base_sec : Width of the bins
+        self.n_bins : Number of bins from midnight to last
+        self.level_counts : {level: numpy array of number of entries in each bin}
+        self.lfl_counts : {(file, line): numpy array of number of entries in each bin}
+    """
+    
+    def __init__(self, first, last):
+        first, last = Timestamp(first), Timestamp(last)
+        self.start_time, self.end_time = get_time_range(first, last)
+        self.base_sec, _ = get_bin_widths(self.start_time, self.end_time)
+        self.midnight = first.normalize()
+        self.n_bins = (last.value - self.midnight.value) // (self.base_sec * 10**9) + 1
+        self.level_counts = {}
+        self.lfl_counts = {}
+        # Log entries come in time order so most have the same second as the one before
+        self.last_second = None
+        self.last_bin = 0
+        
+    def __repr__(self):
+        return 'MinuteCounter(%s, %s) %d bins, %d levels, %d file:lines' % (self.start_time, 
+            self.end_time, self.n_bins, len(self.level_counts), len(self.lfl_counts))
+        
+    def add(self, timestamp, level, file, line):
+        """Count a log entry. The arguments are as returned by load_logs.decode_log_line() 
+            timestamp: String of the form 2011-03-10 15:10:34,687 or 2011-03-10 15:10:34 
+        """
+        second = timestamp.partition(',')[0]
+        if second != self.last_second:
+            self.last_second = second
+            i = (Timestamp(second).value - self.midnight.value) // (self.base_sec * 10**9)
+            # Entries that are out of time order are binned with the entries before them, as 
+            #  load_logs.make_timestamps_unique() moves them there
+            self.last_bin = min(max(i, self.last_bin), self.n_bins - 1)
+        counts = self.level_counts.get(level)
+        if counts is None:
+            counts = self.level_counts[level] = np.zeros(self.n_bins, dtype=np.int32)
+        counts[self.last_bin] += 1
+        counts = self.lfl_counts.get((file, line))
+        if counts is None:
+            counts = self.lfl_counts[(file, line)] = np.zeros(self.n_bins, dtype=np.int32)
+        counts[self.last_bin] += 1
+    
+    def update(self, other):
+        """Add the counts of MinuteCounter other, which must have the same bins"""
+        assert (other.midnight, other.base_sec, other.n_bins) == (
+                self.midnight, self.base_sec, self.n_bins), (other, self)
+        for counts, other_counts in ((self.level_counts, other.level_counts), 
+                                     (self.lfl_counts, other.lfl_counts)):
+            for key, other_key_counts in other_counts.items():
+                if key in counts:
+                    counts[key] += other_key_counts
+                else:
+                    counts[key] = other_key_counts
+            
+    def _get_minute_counts(self, counts, min_count):
+        """Returns smooth_bin_counts() of the keys in counts with at least min_count entries"""
+        keys = [key for key in sorted(counts) if counts[key].sum() >= min_count]
+        values = np.empty((self.n_bins, len(keys)), dtype=np.int64)
+        for i, key in enumerate(keys):
+            values[:, i] = counts[key]
+        if keys and isinstance(keys[0], tuple):
+            keys = pd.MultiIndex.from_tuples(keys)
+        return smooth_bin_counts(values, keys, self.midnight, self.start_time, self.end_time)
+        
+    def get_level_counts(self, min_count=0):
+        """Returns preprocess_logs.get_minute_counts_grouped() by level"""
+        return self._get_minute_counts(self.level_counts, min_count)
+    
+    def get_lfl_counts(self, min_count=0):
+        """Returns preprocess_logs.get_minute_counts_grouped() by file and line"""
+        return self._get_minute_counts(self.lfl_counts, min_count)
@@ -7,6 +7,7 @@ from pandas import DataFrame, Series, Timestamp, DateOffset
 import matplotlib as mpl
 from datetime import datetime, timedelta
 from collections import OrderedDict
+from preprocess_logs import get_uncorrelated
 
 WIDTH = 24
 mpl.rcParams['axes.color_cycle'] = ['b', 'r', 'c', 'y', 'k', 'm']
@@ -109,16 +110,14 @@ for lvl, fl, ln in entry_types.keys()[:NUM_FL]:
     minute_counts = get_minute_counts(entries)
     lfl_rolling_sums.append(((lvl,fl,ln), minute_counts)) 
 
-# The uncorrelated log messages
+# The uncorrelated log messages. See preprocess_logs.get_uncorrelated()
 CORR_THRESH = 0.9
 
-uncorrelated = OrderedDict()
-key,rs = lfl_rolling_sums[0]
-uncorrelated[key] = rs, 0.0
-for key,rs in lfl_rolling_sums[1:]:
-    corr = max(rs.corr(x) for x,_ in uncorrelated.values())
-    if corr < CORR_THRESH:
-        uncorrelated[key] = rs, corr
+# Columns are the positions of the series in lfl_rolling_sums
+lfl_freq = pd.concat([rs for _,rs in lfl_rolling_sums], axis=1, keys=range(len(lfl_rolling_sums)))
+lfl_uncorrelated = get_uncorrelated(lfl_freq, threshold=CORR_THRESH)
+uncorrelated = OrderedDict((lfl_rolling_sums[i][0], (lfl_rolling_sums[i][1], corr)) 
+    for i,corr in lfl_uncorrelated['corr'].iteritems())
 
 uncorr_details = { (lvl,fl,ln) : (corr, df[(df.file==fl) & (df.line==ln)].file.count())
     for (lvl,fl,ln),(rs,corr) in uncorrelated.items()
@@ -11,6 +11,7 @@ from collections import OrderedDict
 from common import ObjectDirectory, versions
 import load_logs
 import preprocess_logs
+from archives import expand_archives
 
 
 
@@ -59,8 +60,13 @@ def get_ids_dirs_logs(top_dir, min_logs):
             dirs_logs[dir] = logs
             #print dir, dirs_logs[dir]
         
-    dirs_logs = {dir: sorted(glob.glob(sanitize(os.path.join(dir, 'server.log*')))) 
-                    for dir in dirs}
+    def get_logs(dir):
+        """server.log* files, including .gz files, and server.log* members of zip archives in dir"""
+        return (sorted(glob.glob(sanitize(os.path.join(dir, 'server.log*'))))
+                + expand_archives(sorted(glob.glob(sanitize(os.path.join(dir, '*.zip')))), 
+                                  load_logs.LOG_MEMBER_PATTERN))
+
+    dirs_logs = {dir: get_logs(dir) for dir in dirs}
                     
     dirs = dirs_logs.keys()                
     dirs = [dir for dir in dirs if len(dirs_logs[dir]) >= min_logs]
@@ -89,7 +95,7 @@ def get_jobs(ids_dirs):
 # http://stackoverflow.com/questions/10012968/fastest-way-to-process-large-files-in-python
 def process_dir(param):
     
-    hdf_path, dir, n_files, n_entries = param
+    hdf_path, dir, n_files, n_entries, keep_logs = param
     print '=' * 80
     print param
     print hdf_path, dir
@@ -107,10 +113,21 @@ def process_dir(param):
     except:
         pass
 
-    path_pattern = os.path.join(dir, 'server.log*')
+    path_pattern = [os.path.join(dir, 'server.log*'), os.path.join(dir, '*.zip')]
 
-    if load_logs.load_log_pattern(hdf_path, path_pattern, n_files=n_files):
-        preprocess_logs.preprocess(directory, n_entries=n_entries)  
+    if keep_logs:
+        ok = load_logs.load_log_pattern(hdf_path, path_pattern, n_files=n_files)
+        df = None
+    else:
+        # The log entries are passed straight to preprocess() without being saved. The history,
+        #  which holds the log file headers, is saved as load_log_pattern() does
+        history, df = load_logs.load_log_pattern_df(path_pattern, n_files=n_files)
+        ok = df is not None
+        if ok:
+            directory.save('history', history)
+
+    if ok:
+        preprocess_logs.preprocess(directory, n_entries=n_entries, df=df)
     else:
         try:
             shutil.rmtree(directory.get_dir())
@@ -122,15 +139,16 @@ def process_dir(param):
     except:
         pass
 
-    try:    
-        os.remove(directory.get_path('logs.h5'))
-    except:
-        pass
+    if not keep_logs:
+        try:    
+            os.remove(directory.get_path('logs.h5'))
+        except:
+            pass
 
     return True
 
  
-def pandasarize_all(top_dir, min_logs, n_files, n_entries):
+def pandasarize_all(top_dir, min_logs, n_files, n_entries, keep_logs=False):
 
     ids_dirs, dirs_logs = get_ids_dirs_logs(top_dir, min_logs)
 
@@ -138,17 +156,18 @@ def pandasarize_all(top_dir, min_logs, n_files, n_entries):
     pprint({dir: len(logs) for dir,logs in dirs_logs.items()})
 
     for hdf_path, dir in get_jobs(ids_dirs):
-        process_dir((hdf_path, dir, n_files, n_entries))  
+        process_dir((hdf_path, dir, n_files, n_entries, keep_logs))  
 
 
-def pandasarize_all_mp(top_dir, min_logs, n_files, n_entries, n_processes):
+def pandasarize_all_mp(top_dir, min_logs, n_files, n_entries, n_processes, keep_logs=False):
 
     ids_dirs, dirs_logs = get_ids_dirs_logs(top_dir, min_logs)
 
     pprint(ids_dirs)
     pprint({dir: len(logs) for dir,logs in dirs_logs.items()})
 
-    params = [(hdf_path, dir, n_files, n_entries) for hdf_path, dir in get_jobs(ids_dirs)]     
+    params = [(hdf_path, dir, n_files, n_entries, keep_logs) 
+              for hdf_path, dir in get_jobs(ids_dirs)]     
     pprint(params)
 
     print '$$$$$$ before'
@@ -173,6 +192,9 @@ def main():
             help='Number of log entries to process')   
     parser.add_option('-p', '--parallel-processes', dest='n_processes', type='int', default=0, 
             help='Number of processed')            
+    parser.add_option('-k', '--keep-logs', dest='keep_logs', action='store_true', default=False, 
+            help='''Save the log entries in logs.h5 in each output directory and keep it. By 
+        default the log entries are passed to preprocessing in memory and not saved''')
     options, args = parser.parse_args()
 
     if not options.top_dir:
@@ -183,9 +205,10 @@ def main():
  
     if options.n_processes:
         pandasarize_all_mp(options.top_dir, options.min_logs, options.n_files, options.n_entries,
-            options.n_processes)
+            options.n_processes, options.keep_logs)
     else:        
-        pandasarize_all(options.top_dir, options.min_logs, options.n_files, options.n_entries)
+        pandasarize_all(options.top_dir, options.min_logs, options.n_files, options.n_entries,
+            options.keep_logs)
 
 
 if __name__ == '__main__':
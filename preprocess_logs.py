@@ -8,23 +8,22 @@
     preprocess.py reads this file and creates
     
     lfl_freq (lfl_freq.h5) Per-minute frequency counts of log entries over the time covered by the server logs for each file:line
-    lfl_freq_corr (lfl_freq_corr.h5) Correlations of each file:line series in lfl_freq
+    lfl_freq_corr (lfl_freq_corr.h5) The highest correlations of each file:line series in lfl_freq
+        with the other series. See get_top_correlations()
+    lfl_uncorrelated (lfl_uncorrelated.h5) The file:line series in lfl_freq that are not 
+        correlated with more common ones. See get_uncorrelated()
     lfl_sorted (lfl_sorted.pkl) Lists of (level,file,line) <==> file:line string mappings
 """
 from __future__ import division
-import re, sys, glob 
+import re, sys, glob, time
 import numpy as np
 import pandas as pd
 from pandas import DataFrame, Series, Timestamp, DateOffset, HDFStore
 from datetime import datetime, timedelta
 from collections import OrderedDict
 from common import ObjectDirectory, versions
-
-
-def truncate_to_minutes(timestamp):
-    """Truncate a timestamp to the previous whole minute"""
-    return Timestamp(datetime(timestamp.year, timestamp.month, timestamp.day, timestamp.hour, 
-        timestamp.minute))
+from minute_counts import SMOOTH_BINS, truncate_to_minutes, get_bin_widths, smooth_bins, \
+    get_time_range, smooth_bin_counts, MinuteCounter
 
 
 def get_details(df):
@@ -34,49 +33,411 @@ def get_details(df):
         'count': df.count()
     }    
     
-# 1 sample/minute for a day    
-MAX_SAMPLES = 24 * 60    
-    
+
 def get_minute_counts(df, start_time, end_time):
-    """Return a DataFrame whose index is 1 minute increments over the duration
-        of df and whose values are the number of entries in df over each
-        minute
+    """Return a Series whose index is sample_sec increments (1 minute for up to a day of logs)
+        from start_time to end_time and whose values are the number of entries in df in 
+        each increment, smoothed over SMOOTH_BINS base_sec bins. See get_bin_widths()
+        Gives the same results as get_minute_counts_pandas()
     """
     print ' get_minute_counts %s %s %d' % (start_time, end_time, len(df)), 
-    assert start_time < end_time
-    duration = end_time - start_time
-    period_min = max(1, duration.total_seconds()/60/MAX_SAMPLES)
-    base_sec = int(period_min * 20.0)
-    sample_sec = int(period_min * 60.0)
-    print 'duration=%s,base_sec=%d,sample_sec=%d' % (duration, base_sec, sample_sec),
+    base_sec, sample_sec = get_bin_widths(start_time, end_time)
+    print 'duration=%s,base_sec=%d,sample_sec=%d' % (end_time - start_time, base_sec, sample_sec),
     
-    bins = df.file.resample('%dS' % base_sec, how='count', convention='center')
+    # The bins are aligned to midnight, as pandas resample() aligns them
+    midnight = df.index.min().normalize()
+    bins = (df.index.values.view(np.int64) - midnight.value) // (base_sec * 10**9)
+    samples = smooth_bins(np.bincount(bins)[:, np.newaxis], base_sec, sample_sec)[:, 0]
+    index = pd.DatetimeIndex(midnight.value + np.arange(len(samples)) * sample_sec * 10**9,
+                             name=df.index.name)
+    bins = Series(samples, index=index, name='file').dropna()
+    # Remove the ends so data is full 1-minutes bins aligned on whole minutes 
+    bins = bins[start_time: end_time]
+    print '>>'
+    return bins
+
+
+def get_minute_counts_pandas(df, start_time, end_time):
+    """pandas resample() and rolling() version of get_minute_counts(). Much slower. 
+        Kept to check get_minute_counts() against
+    """
+    base_sec, sample_sec = get_bin_widths(start_time, end_time)
+    bins = df.file.resample('%dS' % base_sec).count()
     # Empty means zero counts !
     bins = bins.fillna(0.0)
     # Smooth by 2 bin widths
-    bins = pd.rolling_mean(bins, 6, center=True)
+    bins = bins.rolling(SMOOTH_BINS, center=True).mean()
     # Get the 1 minute bins
-    bins = bins.resample('%dS' % sample_sec, how='sum', convention='center')  
+    bins = bins.resample('%dS' % sample_sec).sum()
     # Empty means zero counts !
     bins = bins.fillna(0.0)
     # All the NaNs should have been converted to zeros
     assert not pd.isnull(bins).any()
     # Remove the ends so data is full 1-minutes bins aligned on whole minutes 
-    bins = bins[start_time: end_time]
-    print '>>'
-    return bins
+    return bins[start_time: end_time]
+
+
+def make_test_entries(n_entries, days, n_keys):
+    """Returns a DataFrame of n_entries random log entries over days days with n_keys values
+        of column file, in bursts as in real logs. Each file has an entry in the first minute
+    """
+    start = Timestamp('2013-03-10 10:00:00').value
+    burst_times = np.random.random(max(1, n_entries // 100)) * days * 24 * 3600 * 10**9
+    ts = burst_times[np.random.randint(0, len(burst_times), n_entries)]
+    ts += np.random.exponential(60 * 10**9, n_entries)
+    ts[:n_keys] = np.random.random(n_keys) * 60 * 10**9
+    files = np.random.randint(0, n_keys, n_entries)
+    files[:n_keys] = np.arange(n_keys)
+    order = np.argsort(ts, kind='mergesort')
+    index = pd.DatetimeIndex(start + ts[order].astype(np.int64), name='timestamp')
+    return DataFrame({'file': ['f%d' % i for i in files[order]]}, index=index)
+
+
+def test_get_minute_counts(n_tests=20, max_len=20000, n_keys=5):
+    """Check get_minute_counts() against get_minute_counts_pandas() on random log entries 
+        over a few hours to a few days, and get_minute_counts_grouped(), which counts a 
+        batch of keys with smooth_bins(), against get_minute_counts_pandas() of each key
+    """
+    np.random.seed(111)
+    for _ in range(n_tests):
+        days = np.random.choice([0.1, 0.5, 1.0, 1.5, 3.0])
+        df = make_test_entries(np.random.randint(n_keys, max_len), days, n_keys)
+        start_time, end_time = get_time_range(df.index.min(), df.index.max())
+        if start_time >= end_time:
+            continue
+        expected = get_minute_counts_pandas(df, start_time, end_time)
+        counts = get_minute_counts(df, start_time, end_time)
+        assert counts.index.equals(expected.index), '\n%s\n%s' % (counts, expected)
+        assert np.allclose(counts.values, expected.values), '\n%s\n%s' % (counts, expected)
+        
+        grouped = get_minute_counts_grouped(df, 'file', start_time, end_time)
+        for key in grouped.columns:
+            expected = get_minute_counts_pandas(df[df.file == key], start_time, end_time)
+            counts = grouped[key].dropna()
+            assert counts.index.equals(expected.index), '%s\n%s\n%s' % (key, counts, expected)
+            assert np.allclose(counts.values, expected.values), '%s\n%s\n%s' % (key, counts, 
+                                                                                   expected)
+        
+
+def benchmark_get_minute_counts(n_entries=10**6, days=3.0, n_keys=200):
+    """Print the times that get_minute_counts() and get_minute_counts_grouped() take on 
+        n_entries random log entries with n_keys files over days days and the times that 
+        get_minute_counts_pandas() takes to give the same results
+    """
+    np.random.seed(111)
+    df = make_test_entries(n_entries, days, n_keys)
+    start_time, end_time = get_time_range(df.index.min(), df.index.max())
+    
+    t0 = time.time()
+    get_minute_counts_pandas(df, start_time, end_time)
+    t1 = time.time()
+    get_minute_counts(df, start_time, end_time)
+    t2 = time.time()
+    print 'get_minute_counts: pandas %.3f sec, numpy %.3f sec' % (t1 - t0, t2 - t1)
+    
+    t0 = time.time()
+    for key, df_key in df.groupby('file'):
+        get_minute_counts_pandas(df_key, start_time, end_time)
+    t1 = time.time()
+    get_minute_counts_grouped(df, 'file', start_time, end_time)
+    t2 = time.time()
+    print '%d keys: pandas %.3f sec, numpy %.3f sec' % (n_keys, t1 - t0, t2 - t1)
+
+
+def get_minute_counts_grouped(df, keys, start_time, end_time, min_count=0):
+    """Returns a DataFrame whose columns are get_minute_counts() of the entries in df with 
+        each value of column(s) keys that has at least min_count entries, computed in one 
+        grouped pass over df
+        The column for a key has the values that get_minute_counts() gives over the time range 
+        of that key's entries and NaN elsewhere. Rows outside the ranges of all keys are 
+        dropped, as when a DataFrame is made from a dict of get_minute_counts() Series. 
+        The bins of all keys are aligned to midnight on the day of the first entry in df
+    """
+    print ' get_minute_counts_grouped %s %s %d %s' % (start_time, end_time, len(df), keys),
+    base_sec, sample_sec = get_bin_widths(start_time, end_time)
+    grouped = df.groupby(keys, observed=True)
+    sizes = grouped.size()
+    selected = np.flatnonzero(sizes.values >= min_count)
+    print '%d of %d keys' % (len(selected), len(sizes))
+    
+    # Column of each entry's key in the result. -1 for keys that aren't selected
+    key_columns = np.empty(len(sizes), dtype=np.int64)
+    key_columns.fill(-1)
+    key_columns[selected] = np.arange(len(selected))
+    columns = key_columns[grouped.ngroup().values]
+    
+    # Number of entries of each selected key (column) in each base_sec bin (row)
+    midnight = df.index.min().normalize()
+    bins = (df.index.values.view(np.int64) - midnight.value) // (base_sec * 10**9)
+    n_bins, n_columns = bins.max() + 1, len(selected)
+    is_selected = columns >= 0
+    counts = np.bincount(bins[is_selected] * n_columns + columns[is_selected], 
+                         minlength=n_bins * n_columns).reshape(n_bins, n_columns)
+    
+    counts = smooth_bin_counts(counts, sizes.index[selected], midnight, start_time, end_time)
+    counts.index.name = df.index.name
+    return counts
+
+
+# Each key keeps its CORR_TOP_K most correlated partners. CORR_MIN, if not None, also keeps
+#  all partners that a key has a correlation of at least CORR_MIN with
+CORR_TOP_K = 20
+CORR_MIN = None
+# Number of columns whose correlations are computed at a time
+CORR_BLOCK_SIZE = 256
+# get_uncorrelated() keeps keys whose correlations with the keys it has kept are all below this
+CORR_THRESH = 0.9
 
 
-def preprocess(directory, n_entries):
+def get_masked_corr(a, b):
+    """Returns the correlations between the columns of 2-D arrays a and b over the rows where 
+        both columns have values, as DataFrame.corr() computes them. NaNs are missing values
+        The columns should be roughly centered so that the sums here don't lose precision
+    """
+    present_a, present_b = ~np.isnan(a), ~np.isnan(b)
+    xa, xb = np.where(present_a, a, 0.0), np.where(present_b, b, 0.0)
+    ma, mb = present_a.astype(np.float64), present_b.astype(np.float64)
+    a_complete, b_complete = present_a.all(), present_b.all()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Sums over the rows where both the column of a and the column of b have values. When 
+        #  all the columns of one array have values these are column sums of the other array
+        if b_complete:
+            n = ma.sum(axis=0)[:, np.newaxis]
+        elif a_complete:
+            n = mb.sum(axis=0)[np.newaxis, :]
+        else:
+            n = ma.T.dot(mb)
+        if b_complete:
+            sa, saa = (v.sum(axis=0)[:, np.newaxis] for v in (xa, xa * xa))
+        else:
+            sa, saa = (v.T.dot(mb) for v in (xa, xa * xa))
+        if a_complete:
+            sb, sbb = (v.sum(axis=0)[np.newaxis, :] for v in (xb, xb * xb))
+        else:
+            sb, sbb = (ma.T.dot(v) for v in (xb, xb * xb))
+        var_a = saa - sa * sa / n
+        var_b = sbb - sb * sb / n
+        corr = (xa.T.dot(xb) - sa * sb / n) / np.sqrt(var_a * var_b)
+    # Columns that are constant over those rows have no correlations. Rounding can leave them
+    #  with a tiny variance
+    corr[(var_a <= 1e-10 * saa) | (var_b <= 1e-10 * sbb)] = np.nan
+    return corr
+
+
+def standardize(values, dtype=np.float32):
+    """Returns centered, x, constant, incomplete for the columns of 2-D array values, which
+        has NaNs for missing values. get_corr() uses these to compute correlations 
+            centered: values less their column means
+            x: centered divided by the column standard deviations as dtype. 0 in the 
+               incomplete columns
+            constant: Mask of the columns with no variance
+            incomplete: Mask of the columns with missing values
+    """
+    with np.errstate(invalid='ignore'):
+        centered = values - np.nanmean(values, axis=0)
+        std = np.nanstd(values, axis=0)
+    constant = ~(std > 0)
+    incomplete = np.isnan(values).any(axis=0)
+    
+    x = centered / np.where(constant, 1.0, std)
+    x[:, incomplete] = 0.0
+    return centered, x.astype(dtype), constant, incomplete
+
+
+def get_corr(standardized, a, b):
+    """Returns the correlations between the columns a and the columns b of the values that 
+        standardize() returned standardized for, as DataFrame.corr() computes them over the 
+        rows where both columns have values. a and b are arrays of column numbers
+        The correlations between columns with no missing values are dot products of their x 
+        columns. Those with other columns are computed with get_masked_corr() in float64 as 
+        float32 sums over subsets of rows lose too much precision
+    """
+    centered, x, constant, incomplete = standardized
+    corr = x[:, a].T.dot(x[:, b]) / len(x)
+    a_incomplete, b_incomplete = incomplete[a], incomplete[b]
+    for a_mask, b_mask in ((a_incomplete, b_incomplete), (~a_incomplete, b_incomplete), 
+                           (a_incomplete, ~b_incomplete)):
+        if a_mask.any() and b_mask.any():
+            corr[np.ix_(a_mask, b_mask)] = get_masked_corr(centered[:, a[a_mask]], 
+                                                           centered[:, b[b_mask]])
+    corr[:, constant[b]] = np.nan 
+    corr[constant[a], :] = np.nan
+    np.clip(corr, -1.0, 1.0, out=corr)
+    return corr
+    
+
+def get_top_correlations(freq, top_k=CORR_TOP_K, min_corr=CORR_MIN, 
+                         block_size=CORR_BLOCK_SIZE):
+    """Returns the highest correlations between the columns of DataFrame freq
+        The result is a DataFrame with a (key, partner) MultiIndex and a float32 corr column. 
+        Each key has its top_k most correlated partners and, if min_corr is not None, all 
+        partners with corr >= min_corr, in descending order of corr. The keys are in the order 
+        of freq's columns
+        e.g. lfl_freq_corr.loc['JobManager:12'] are the partners of JobManager:12 and 
+             lfl_freq_corr['corr'].get(('JobManager:12', 'UserSync:3')) is None if that 
+             correlation was too low to keep
+        
+        Correlations are the same as DataFrame.corr() gives, over the rows where both columns 
+        have values, and non-numeric columns are skipped in the same way. They are computed 
+        for block_size keys at a time so the full matrix is never in memory. See get_corr()
+    """
+    freq = freq.select_dtypes(include=[np.number])
+    keys = freq.columns
+    n_keys = len(keys)
+    standardized = standardize(freq.values)
+    all_keys = np.arange(n_keys)
+    
+    key_list, partner_list, corr_list = [], [], []
+    for j0 in range(0, n_keys, block_size):
+        j1 = min(n_keys, j0 + block_size)
+        rows = np.arange(j1 - j0)
+        corr = get_corr(standardized, np.arange(j0, j1), all_keys)
+        corr[rows, rows + j0] = np.nan
+        corr[np.isnan(corr)] = -np.inf
+        
+        if min_corr is not None:
+            keep = corr >= min_corr
+        else:
+            keep = np.zeros(corr.shape, dtype=bool)
+        if top_k < n_keys:
+            top = np.argpartition(-corr, top_k, axis=1)[:, :top_k]
+        else:
+            top = np.tile(np.arange(n_keys), (j1 - j0, 1))
+        keep[rows[:, np.newaxis], top] = True
+        keep &= np.isfinite(corr)
+        
+        key_i, partner_i = np.nonzero(keep)
+        key_list.append(key_i + j0)
+        partner_list.append(partner_i)
+        corr_list.append(corr[key_i, partner_i])
+    
+    key_i = np.concatenate(key_list) if key_list else np.empty(0, dtype=np.int64)
+    partner_i = np.concatenate(partner_list) if partner_list else np.empty(0, dtype=np.int64)
+    corrs = np.concatenate(corr_list) if corr_list else np.empty(0, dtype=np.float32)
+    order = np.lexsort((-corrs, key_i))
+    index = pd.MultiIndex.from_arrays([keys[key_i[order]], keys[partner_i[order]]], 
+                                      names=['key', 'partner'])
+    return DataFrame({'corr': corrs[order].astype(np.float32)}, index=index)
+
+
+def get_uncorrelated(freq, threshold=CORR_THRESH, block_size=CORR_BLOCK_SIZE):
+    """Returns the columns of DataFrame freq that are not correlated with each other, picked 
+        greedily in the order of freq's columns: A column is kept if its correlations with all
+        the columns kept before it are below threshold
+        The result is a DataFrame indexed by the kept keys, in order, with a corr column of each 
+        key's highest correlation with the keys kept before it, NaN if there are none
+        e.g. get_uncorrelated(lfl_freq) are the file:lines whose frequencies are not explained
+             by those of more common file:lines
+        
+        Correlations are computed as in get_top_correlations() but in float64. Non-numeric 
+        columns and columns with no variance are skipped and correlations that can't be 
+        computed are ignored
+        The keys are taken block_size at a time. A block's keys are tested against all the 
+        keys kept before the block in one matrix product, then the greedy choice is made 
+        among the block's remaining keys from the matrix of their correlations with each other
+        Gives the same results as get_uncorrelated_pandas()
+    """
+    freq = freq.select_dtypes(include=[np.number])
+    keys = freq.columns
+    standardized = standardize(freq.values, dtype=np.float64)
+    _, _, constant, _ = standardized
+    candidates = np.flatnonzero(~constant)
+    
+    kept, kept_corr = np.empty(0, dtype=np.int64), np.empty(0)
+    for j0 in range(0, len(candidates), block_size):
+        block = candidates[j0: j0 + block_size]
+        # Highest correlation of each key in the block with the keys kept before the block
+        best = np.empty(len(block))
+        best.fill(-np.inf)
+        if len(kept):
+            corr = get_corr(standardized, block, kept)
+            corr[np.isnan(corr)] = -np.inf
+            best = corr.max(axis=1)
+        block, best = block[best < threshold], best[best < threshold]
+        
+        corr = get_corr(standardized, block, block)
+        corr[np.isnan(corr)] = -np.inf
+        block_kept, block_corr = [], []
+        for i in range(len(block)):
+            if best[i] < threshold:
+                block_kept.append(i)
+                block_corr.append(best[i])
+                # The keys after i in the block must be uncorrelated with i too
+                np.maximum(best, corr[:, i], out=best)
+        kept = np.r_[kept, block[block_kept]]
+        kept_corr = np.r_[kept_corr, block_corr]
+        
+    kept_corr[np.isinf(kept_corr)] = np.nan
+    return DataFrame({'corr': kept_corr}, index=keys[kept])
+
 
-    hdf_path = directory.get_path('logs.h5', temp=False)
-    print 'hdf_path: %s' % hdf_path
+def get_uncorrelated_pandas(freq, threshold=CORR_THRESH):
+    """Series.corr() loop version of get_uncorrelated(), as in nb_pandas-template-big.py. 
+        Much slower. Kept to check get_uncorrelated() against
+    """
+    freq = freq.select_dtypes(include=[np.number])
+    uncorrelated = OrderedDict()
+    for key, rs in freq.iteritems():
+        if not rs.std(ddof=0) > 0:
+            continue
+        corr = Series([rs.corr(freq[k]) for k in uncorrelated]).max()
+        if not corr >= threshold:
+            uncorrelated[key] = corr
+    return DataFrame({'corr': np.array(uncorrelated.values(), dtype=np.float64)}, 
+                     index=freq.columns[[freq.columns.get_loc(k) for k in uncorrelated]])
+
+
+def test_get_uncorrelated(n_tests=10, n_keys=80, n_rows=300):
+    """Check get_uncorrelated() against get_uncorrelated_pandas() on random series made from 
+        a few shared patterns, with missing values outside random ranges, constant series and 
+        a non-numeric series, as in lfl_freq
+    """
+    np.random.seed(111)
+    for _ in range(n_tests):
+        patterns = np.random.poisson(50, (n_rows, 5)).astype(np.float64)
+        weights = np.random.random((5, n_keys)) * (np.random.random((5, n_keys)) < 0.3)
+        values = patterns.dot(weights) + np.random.poisson(1, (n_rows, n_keys))
+        values[:, np.random.randint(0, n_keys, 2)] = 3.0
+        for j in np.flatnonzero(np.random.random(n_keys) < 0.5):
+            lo = np.random.randint(0, n_rows - 1)
+            hi = np.random.randint(lo + 1, n_rows + 1)
+            values[:lo, j] = np.nan
+            values[hi:, j] = np.nan
+        freq = DataFrame(values, columns=['F:%d' % j for j in range(n_keys)])
+        freq['F:none'] = Series(dtype=object)
+        for threshold in 0.5, CORR_THRESH:
+            expected = get_uncorrelated_pandas(freq, threshold)
+            for block_size in 7, CORR_BLOCK_SIZE:
+                kept = get_uncorrelated(freq, threshold, block_size)
+                assert kept.index.equals(expected.index), '\n%s\n%s' % (kept, expected)
+                assert np.allclose(kept['corr'].values, expected['corr'].values, 
+                                   equal_nan=True), '\n%s\n%s' % (kept, expected)
+
+
+def preprocess(directory, n_entries, df=None):
+    """Create the objects listed at the top of this file in directory from the log entries in
+        DataFrame df, as in the history, df returned by load_logs.load_log_pattern_df(), or from 
+        directory's logs.h5 if df is None
+    """
 
-    store = HDFStore(hdf_path)
-    print 'Keys: %s' % store.keys()
-    print store
-    store.close()
-    df = pd.read_hdf(hdf_path, 'logs')
+    if df is None:
+        hdf_path = directory.get_path('logs.h5', temp=False)
+        print 'hdf_path: %s' % hdf_path
+
+        store = HDFStore(hdf_path)
+        print 'Keys: %s' % store.keys()
+        print store
+        is_table = store.get_storer('logs').is_table
+        store.close()
+        if is_table:
+            # Only the columns used here are kept in memory
+            df = directory.query('logs.h5', columns=['level', 'file', 'line']).df()
+        else:
+            # logs.h5 files saved before the final store was a table are in fixed format, 
+            #  which can only be read whole. Their columns are given the table's types so the 
+            #  results are the same
+            df = directory.load('logs.h5')[['level', 'file', 'line']]
+            df = df.astype({'level': 'category', 'file': 'category', 'line': np.int32})
 
     #df = directory.load('logs.h5')
     print 'df: %s' % df
@@ -110,8 +471,7 @@ def preprocess(directory, n_entries):
     print 'orginal: start_time, end_time = %s, %s' % (start_time, end_time)
 
     # Start time and end time trunctated to whole minutes
-    start_time = truncate_to_minutes(start_time + timedelta(minutes=2))
-    end_time = truncate_to_minutes(end_time - timedelta(minutes=2))
+    start_time, end_time = get_time_range(start_time, end_time)
     print 'cleaned: start_time, end_time = %s, %s' % (start_time, end_time)
 
     details = get_details(df)
@@ -122,8 +482,8 @@ def preprocess(directory, n_entries):
     print 'minute_counts: %s\n%s' % (type(minute_counts), minute_counts.describe())    
     print 'total entries: %s' % minute_counts.sum()
 
-    level_counts = {level: get_minute_counts(df[df.level==level], start_time, end_time)
-            for level in levels}
+    level_freq = get_minute_counts_grouped(df, 'level', start_time, end_time)
+    level_counts = {level: level_freq[level].dropna() for level in levels}
  
     #level_peaks = {level: get_peak(level_counts[level])  for level in levels}  
     # print 'level_peaks: %s' % level_peaks     
@@ -139,9 +499,10 @@ def preprocess(directory, n_entries):
     #
     # Get all the unique log messages
     #
-    level_file_line = df.groupby(['level', 'file', 'line'])
+    # observed=True so that categorical level and file only give combinations that occur
+    level_file_line = df.groupby(['level', 'file', 'line'], observed=True)
     lfl_size = level_file_line.size()
-    lfl_sorted = lfl_size.order(ascending=False)
+    lfl_sorted = lfl_size.sort_values(ascending=False)
     print 'lfl_sorted: %s' % str(lfl_sorted.shape)
 
     #directory.save('level_file_line', tuple(level_file_line)) 
@@ -165,19 +526,24 @@ def preprocess(directory, n_entries):
     # Build the correlation table
     # 
     threshold = min(100, len(df)//1000)
-    lfl_freq_dict = {
-        s: get_minute_counts(df[(df.file==fl) & (df.line==ln)], start_time, end_time)
-            for s,(lvl,fl,ln) in string_to_lfl.items()
-                if len(df[(df.file==fl) & (df.line==ln)]) >= threshold
-    }
+    # Entries are grouped by file:line, which is the key of each column
+    lfl_counts = get_minute_counts_grouped(df, ['file', 'line'], start_time, end_time, 
+                                           min_count=threshold)
+    lfl_freq_dict = {'%s:%d' % (fl,ln): counts for (fl,ln), counts in lfl_counts.iteritems()}
     print '++++'
     lfl_freq = DataFrame(lfl_freq_dict, columns=string_to_lfl.keys())              
     directory.save('lfl_freq', lfl_freq)
 
-    lfl_freq_corr = lfl_freq.corr()
+    lfl_freq_corr = get_top_correlations(lfl_freq)
     directory.save('lfl_freq_corr', lfl_freq_corr)
     print 'lfl_freq_corr: %s' % str(lfl_freq_corr.shape)
 
+    # lfl_freq's columns are in descending order of number of entries so the most common 
+    #  file:line of each correlated group is kept
+    lfl_uncorrelated = get_uncorrelated(lfl_freq)
+    directory.save('lfl_uncorrelated', lfl_uncorrelated)
+    print 'lfl_uncorrelated: %s' % str(lfl_uncorrelated.shape)
+
 
 def main():
     import optparse
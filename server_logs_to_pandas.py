@@ -11,6 +11,7 @@ import pandas as pd
 from pandas import DataFrame, Series, Timestamp, DateOffset
 import matplotlib as mpl
 import matplotlib.pyplot as plt
+from load_logs import get_log_summary, USEC_NS
 
 def versions():
     print '-' * 60
@@ -95,15 +96,14 @@ def log_file_to_df(log_file):
     del entries
     return df
 
-USEC = DateOffset(microseconds=1)
-
 def make_timestamps_unique(df):
     """Make all the timestamps in DataFrame df unique by making each
         timestamp at least 1 sec greater than timestamp of preceeding row
     """
-    for i in range(1, len(df)):
-        if df.ix[i,'timestamp'] <= df.ix[i-1,'timestamp']:
-            df.ix[i,'timestamp'] = df.ix[i-1,'timestamp'] + USEC
+    ts = df['timestamp'].values.view(np.int64)
+    # ts[i] = max(ts[i], ts[i-1] + USEC)  <=>  ts - i*USEC = running max of (ts - i*USEC)
+    steps = np.arange(len(ts), dtype=np.int64) * USEC_NS
+    df['timestamp'] = (np.maximum.accumulate(ts - steps) + steps).view('datetime64[ns]')
             
 
 def load_log(log_file):
@@ -118,15 +118,22 @@ def load_log(log_file):
 
 def load_log_pattern(path_pattern):  
     path_list = glob.glob(path_pattern) 
+    # The log files are ordered and checked for overlaps from their summaries before any of
+    #  them are loaded
+    summaries = {path: get_log_summary(path) for path in path_list}
+    path_list = [path for path in path_list if summaries[path]['first'] is not None]
+    path_list.sort(key=lambda path: summaries[path]['first'])
+    for path0, path1 in zip(path_list, path_list[1:]):
+        assert summaries[path0]['last'] < summaries[path1]['first'], '\n%s %s\n%s %s' % (
+            path0, summaries[path0], path1, summaries[path1])
     df_list = [load_log(path) for path in path_list]
-    dfs.sort(key = lambda x: x.index[0])
     for i,df in enumerate(df_list):
         print '%2d: %s  ---  %s' % (i, df.index[0], df.index[-1])
 
     df_all = pd.concat(df_list)
     for df in df_list:
         print len(df)
-    print sum(len(df) for df in dfs), len(df_all)
+    print sum(len(df) for df in df_list), len(df_all)
     print df_all
 
     for i in range(1, len(df_list)):